@@ -1,22 +1,82 @@
 #!/usr/bin/env python3
 import logging
 import os
+import queue
+import re
 import sqlite3
-import random
-import string
+import threading
+import time
 import asyncio
+from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
 from datetime import datetime
-import pytz
+from zoneinfo import ZoneInfo
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes, ConversationHandler
-from telegram.error import TelegramError
+from telegram.error import TelegramError, RetryAfter
 
-MSK = pytz.timezone('Europe/Moscow')
+# stdlib zoneinfo (PEP 615) instead of pytz; no localize() dance
+MSK = ZoneInfo('Europe/Moscow')
 ADMIN_USER_ID = int(os.getenv('ADMIN_ID', '933698505'))
 
-# Global dictionary to track timeout tasks: {(game_id, user_id, question_idx): asyncio.Task}
+# One shared timeout timer per round: {(game_id, question_idx): asyncio.Task}
+# so a six-player room keeps one sleeping task per question, not six
 timeout_tasks = {}
 
+# In-memory answer tracker: {game_id: {'total': N, 'answered': [set of player ids per question]}}
+# Lets the answer path skip the COUNT queries; rebuilt from the DB after a restart
+game_answer_state = {}
+
+# Per-game locks guarding the "all players answered" transition, plus the
+# set of question indexes already advanced: {game_id: set of question_idx}.
+# Without this, the last player's duplicate submission (or two finishers
+# racing) can trigger send_question_to_players twice for the same round
+GAME_LOCKS = defaultdict(asyncio.Lock)
+_advanced_questions = defaultdict(set)
+
+# Registry of rooms currently waiting for players: {room_code: (game_id, created_by)}
+# Served from memory on the hot button paths, with a DB fallback after restarts
+waiting_rooms = {}
+
+# Players we are currently waiting on: {user_id: (game_id, question_idx, player_row_id)}
+# Saves the per-message SQL lookup in the answer handlers; the DB query
+# remains as a fallback so games survive a bot restart
+awaiting_answer = {}
+
+# Statements issued from several call sites; sharing one string object
+# keeps them exact hits in the per-connection statement cache. One
+# stored message per (game, user): the upsert replaces the old
+# DELETE + INSERT pair
+SQL_UPSERT_GAME_MESSAGE = '''
+    INSERT INTO game_messages (game_id, user_id, message_id)
+    VALUES (?, ?, ?)
+    ON CONFLICT (game_id, user_id) DO UPDATE SET message_id = excluded.message_id
+'''
+
+# Cap concurrent Telegram sends just below the API's ~30 msg/s global
+# limit so a big room's broadcast cannot trigger flood control
+SEND_SEM = asyncio.Semaphore(25)
+
+async def _tg_call(func, *args, **kwargs):
+    """Call one Telegram API method under the global send semaphore.
+
+    When the API answers with flood control, wait out the server's
+    Retry-After once and resend instead of dropping the message.
+    """
+    async with SEND_SEM:
+        try:
+            return await func(*args, **kwargs)
+        except RetryAfter as e:
+            logger.warning(f"Flood control, retrying in {e.retry_after}s")
+            await asyncio.sleep(e.retry_after)
+            return await func(*args, **kwargs)
+
+# Last room text rendered per user; lets update_room_players skip
+# edit_message_text calls that would change nothing (Telegram rejects
+# those with "message is not modified" anyway)
+_last_room_text = {}
+
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
@@ -27,6 +87,35 @@ DB_FILE = 'game_data.db'
 DATABASE_URL = os.getenv('DATABASE_URL')
 USE_POSTGRES = DATABASE_URL is not None
 
+# Unique-constraint violations to catch on the active backend: psycopg2
+# raises its own IntegrityError, not sqlite3's
+if USE_POSTGRES:
+    import psycopg2
+    _INTEGRITY_ERRORS = (sqlite3.IntegrityError, psycopg2.IntegrityError)
+else:
+    _INTEGRITY_ERRORS = (sqlite3.IntegrityError,)
+
+# Pool of long-lived connections so hot paths reuse SQLite's page cache
+# instead of paying the open/parse/close cost on every Telegram event
+POOL_SIZE = 8
+_conn_pool: queue.Queue = queue.Queue(maxsize=POOL_SIZE)
+
+# SQLite allows many readers under WAL but only one writer; serializing
+# our own write transactions here means they queue instead of bouncing
+# off SQLITE_BUSY, while reads keep running concurrently
+_write_lock = threading.Lock()
+
+class PooledConnection:
+    """Proxy around a DB connection that returns it to the pool on close()"""
+    def __init__(self, conn):
+        self._conn = conn
+
+    def close(self):
+        _release_connection(self._conn)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
 class CursorWrapper:
     """Wrapper for cursor that converts SQLite ? placeholders to PostgreSQL %s"""
     def __init__(self, cursor, is_postgres):
@@ -37,7 +126,12 @@ class CursorWrapper:
         if self.is_postgres:
             query = query.replace('?', '%s')
         return self.cursor.execute(query, params)
-    
+
+    def executemany(self, query, seq_of_params):
+        if self.is_postgres:
+            query = query.replace('?', '%s')
+        return self.cursor.executemany(query, seq_of_params)
+
     def fetchone(self):
         return self.cursor.fetchone()
     
@@ -47,110 +141,165 @@ class CursorWrapper:
     def __getattr__(self, name):
         return getattr(self.cursor, name)
 
-def get_db_connection():
-    """Get database connection"""
+def _connect():
+    """Create a new raw database connection"""
     if USE_POSTGRES:
         try:
             import psycopg2
             return psycopg2.connect(DATABASE_URL)
         except Exception as e:
             logger.error(f"Failed to connect to PostgreSQL: {e}. Falling back to SQLite")
-            return sqlite3.connect(DB_FILE)
+            return _tune_sqlite(sqlite3.connect(
+                DB_FILE, check_same_thread=False, cached_statements=256))
     else:
-        return sqlite3.connect(DB_FILE)
+        return _tune_sqlite(sqlite3.connect(
+            DB_FILE, check_same_thread=False, cached_statements=256))
+
+def _tune_sqlite(conn):
+    """Apply performance PRAGMAs to a fresh SQLite connection.
+
+    WAL lets readers run concurrently with the writer and synchronous=NORMAL
+    drops one fsync per commit - the dominant cost of this bot's many small
+    transactions. journal_mode persists in the DB file but the others are
+    per-connection, so they are applied on every connect.
+    """
+    cursor = conn.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA busy_timeout=5000')
+    cursor.execute('PRAGMA cache_size=-20000')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA mmap_size=134217728')
+    # The schema declares FOREIGN KEYs but sqlite3 ignores them unless
+    # this is switched on per connection - without it they are cosmetic
+    cursor.execute('PRAGMA foreign_keys=ON')
+    # Named column access without changing positional unpacking anywhere
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _release_connection(conn):
+    """Return a connection to the pool (or close it if the pool is full)"""
+    try:
+        conn.rollback()
+        _conn_pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+    except Exception:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+def get_db_connection():
+    """Get a pooled database connection; close() returns it to the pool"""
+    try:
+        conn = _conn_pool.get_nowait()
+    except queue.Empty:
+        conn = _connect()
+    return PooledConnection(conn)
 
 def get_cursor(conn):
-    """Get a wrapped cursor that handles placeholder conversion"""
+    """Get a wrapped cursor that handles placeholder conversion.
+
+    Rows support both positional and named column access on either
+    backend (sqlite3.Row / psycopg2 DictRow).
+    """
     if USE_POSTGRES:
-        return CursorWrapper(conn.cursor(), True)
+        import psycopg2.extras
+        return CursorWrapper(conn.cursor(cursor_factory=psycopg2.extras.DictCursor), True)
     else:
         return CursorWrapper(conn.cursor(), False)
 
+# All static DDL in one script shared by both dialects - only the
+# primary-key and 64-bit integer spellings differ, substituted once at
+# import, so the table definitions cannot drift apart
+_PK = 'SERIAL PRIMARY KEY' if USE_POSTGRES else 'INTEGER PRIMARY KEY AUTOINCREMENT'
+_BIGINT = 'BIGINT' if USE_POSTGRES else 'INTEGER'
+
+SCHEMA_SQL = f'''
+    CREATE TABLE IF NOT EXISTS games (
+        game_id {_PK},
+        room_code TEXT,
+        created_by {_BIGINT},
+        status TEXT,
+        current_question_idx INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS game_players (
+        id {_PK},
+        game_id INTEGER,
+        user_id {_BIGINT},
+        username TEXT,
+        first_name TEXT,
+        awaiting_question_idx INTEGER DEFAULT -1,
+        is_admin INTEGER DEFAULT 0,
+        joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (game_id) REFERENCES games(game_id)
+    );
+    CREATE TABLE IF NOT EXISTS game_answers (
+        id {_PK},
+        game_id INTEGER,
+        question_idx INTEGER,
+        player_idx INTEGER,
+        answer TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (game_id) REFERENCES games(game_id)
+    );
+    CREATE TABLE IF NOT EXISTS game_messages (
+        id {_PK},
+        game_id INTEGER,
+        user_id {_BIGINT},
+        message_id INTEGER,
+        FOREIGN KEY (game_id) REFERENCES games(game_id)
+    );
+    CREATE TABLE IF NOT EXISTS story_history (
+        id {_PK},
+        room_code TEXT,
+        story_text TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS bot_sessions (
+        id {_PK},
+        started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS user_activity (
+        id {_PK},
+        user_id {_BIGINT},
+        username TEXT,
+        last_action TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+'''
+
+def _has_column(cursor, table, column):
+    """Check whether a table already has a column.
+
+    Probing with ALTER TABLE and catching the error poisons the open
+    transaction on Postgres; asking the catalog first avoids the
+    exception entirely.
+    """
+    if USE_POSTGRES:
+        cursor.execute(
+            'SELECT 1 FROM information_schema.columns'
+            ' WHERE table_name = ? AND column_name = ?', (table, column))
+        return cursor.fetchone() is not None
+    cursor.execute(f'PRAGMA table_info({table})')
+    return any(row[1] == column for row in cursor.fetchall())
+
 def init_db():
     """Initialize database"""
     conn = get_db_connection()
     cursor = get_cursor(conn)
-    
+
     if USE_POSTGRES:
-        # PostgreSQL syntax
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS games (
-                game_id SERIAL PRIMARY KEY,
-                room_code TEXT,
-                created_by BIGINT,
-                status TEXT,
-                current_question_idx INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS game_players (
-                id SERIAL PRIMARY KEY,
-                game_id INTEGER,
-                user_id BIGINT,
-                username TEXT,
-                first_name TEXT,
-                awaiting_question_idx INTEGER DEFAULT -1,
-                is_admin INTEGER DEFAULT 0,
-                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (game_id) REFERENCES games(game_id)
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS game_answers (
-                id SERIAL PRIMARY KEY,
-                game_id INTEGER,
-                question_idx INTEGER,
-                player_idx INTEGER,
-                answer TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (game_id) REFERENCES games(game_id)
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS game_messages (
-                id SERIAL PRIMARY KEY,
-                game_id INTEGER,
-                user_id BIGINT,
-                message_id INTEGER,
-                FOREIGN KEY (game_id) REFERENCES games(game_id)
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS story_history (
-                id SERIAL PRIMARY KEY,
-                room_code TEXT,
-                story_text TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS bot_sessions (
-                id SERIAL PRIMARY KEY,
-                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_activity (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT,
-                username TEXT,
-                last_action TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
+        # psycopg2 runs the whole multi-statement script in one execute
+        cursor.execute(SCHEMA_SQL)
+
         # Commit all table creations before migrations
         conn.commit()
-        
+
         # Migration: drop old UNIQUE constraint if it exists
         try:
-            cursor.execute('ALTER TABLE games DROP CONSTRAINT games_room_code_key')
+            cursor.execute('ALTER TABLE games DROP CONSTRAINT IF EXISTS games_room_code_key')
             conn.commit()
         except Exception:
             pass
@@ -165,166 +314,316 @@ def init_db():
         except Exception:
             pass
         
-        # Migration: add username column if it doesn't exist
-        try:
+        # Migration: add username column if it doesn't exist (catalog
+        # check instead of an ALTER probe that would poison the
+        # transaction on failure)
+        if not _has_column(cursor, 'user_activity', 'username'):
             cursor.execute('ALTER TABLE user_activity ADD COLUMN username TEXT')
             conn.commit()
+
+        # One player row per user per game; lets joins use INSERT ... ON CONFLICT
+        try:
+            cursor.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_game_players_game_user
+                ON game_players(game_id, user_id)
+            ''')
+            conn.commit()
         except Exception:
             pass
     else:
-        # SQLite syntax
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS games (
-                game_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                room_code TEXT,
-                created_by INTEGER,
-                status TEXT,
-                current_question_idx INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS game_players (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                game_id INTEGER,
-                user_id INTEGER,
-                username TEXT,
-                first_name TEXT,
-                awaiting_question_idx INTEGER DEFAULT -1,
-                is_admin INTEGER DEFAULT 0,
-                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (game_id) REFERENCES games(game_id)
-            )
-        ''')
-        
-        try:
-            cursor.execute('ALTER TABLE game_players ADD COLUMN awaiting_question_idx INTEGER DEFAULT -1')
-        except sqlite3.OperationalError:
-            pass
-        
+        # executescript parses the DDL once and runs it in one transaction
+        conn.executescript(SCHEMA_SQL)
+
+        # Migrations gated on user_version, so the ALTERs run once per
+        # database file instead of being attempted (and caught) on every
+        # startup
+        cursor.execute('PRAGMA user_version')
+        schema_version = cursor.fetchone()[0]
+        if schema_version < 1:
+            # Check the catalog before each ALTER instead of probing and
+            # catching OperationalError on pre-versioned databases
+            for table, column, migration_ddl in (
+                ('game_players', 'awaiting_question_idx',
+                 'ALTER TABLE game_players ADD COLUMN awaiting_question_idx INTEGER DEFAULT -1'),
+                ('game_players', 'is_admin',
+                 'ALTER TABLE game_players ADD COLUMN is_admin INTEGER DEFAULT 0'),
+                ('user_activity', 'username',
+                 'ALTER TABLE user_activity ADD COLUMN username TEXT'),
+            ):
+                if not _has_column(cursor, table, column):
+                    cursor.execute(migration_ddl)
+            # One player row per user per game; lets joins use
+            # INSERT ... ON CONFLICT
+            cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_game_players_game_user ON game_players(game_id, user_id)')
+            cursor.execute('PRAGMA user_version = 1')
+            conn.commit()
+
+    # Legacy databases may hold duplicate answer/message rows from the
+    # old INSERT-per-edit and DELETE+INSERT paths; keep only the newest
+    # so the unique indexes below can be created
+    for dedup_sql in (
+        '''DELETE FROM game_answers WHERE id NOT IN (
+               SELECT MAX(id) FROM game_answers
+               GROUP BY game_id, question_idx, player_idx
+           )''',
+        '''DELETE FROM game_messages WHERE id NOT IN (
+               SELECT MAX(id) FROM game_messages
+               GROUP BY game_id, user_id
+           )''',
+        '''DELETE FROM user_activity WHERE id NOT IN (
+               SELECT MAX(id) FROM user_activity
+               GROUP BY user_id
+           )''',
+    ):
         try:
-            cursor.execute('ALTER TABLE game_players ADD COLUMN is_admin INTEGER DEFAULT 0')
-        except sqlite3.OperationalError:
+            cursor.execute(dedup_sql)
+            conn.commit()
+        except Exception:
             pass
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS game_answers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                game_id INTEGER,
-                question_idx INTEGER,
-                player_idx INTEGER,
-                answer TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (game_id) REFERENCES games(game_id)
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS game_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                game_id INTEGER,
-                user_id INTEGER,
-                message_id INTEGER,
-                FOREIGN KEY (game_id) REFERENCES games(game_id)
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS story_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                room_code TEXT,
-                story_text TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS bot_sessions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_activity (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                username TEXT,
-                last_action TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Migration: add username column if it doesn't exist
+
+    # Indexes for the hot per-game lookups on the answer path
+    # (same syntax on both PostgreSQL and SQLite)
+    for index_ddl in (
+        # Unique: one row per (game, question, player) is what lets
+        # _save_answer run a single ON CONFLICT upsert. The old
+        # non-unique index of the same shape is dropped first.
+        'DROP INDEX IF EXISTS idx_game_answers_game_q_p',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_game_answers_unique ON game_answers(game_id, question_idx, player_idx)',
+        'CREATE INDEX IF NOT EXISTS idx_game_players_game ON game_players(game_id)',
+        # handle_any_text runs on every text message and filters by these
+        'CREATE INDEX IF NOT EXISTS idx_game_players_user ON game_players(user_id, awaiting_question_idx)',
+        'DROP INDEX IF EXISTS idx_game_messages_game_user',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_game_messages_unique ON game_messages(game_id, user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_games_room_code ON games(room_code)',
+        # generate_stories reads a game's answers grouped by player
+        'CREATE INDEX IF NOT EXISTS idx_game_answers_game_player ON game_answers(game_id, player_idx, question_idx)',
+        # Player lists are always ordered by joined_at
+        'CREATE INDEX IF NOT EXISTS idx_game_players_game_joined ON game_players(game_id, joined_at)',
+        # At most one waiting game per room code; also backs the
+        # room-code collision retry in start_new_game
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_games_waiting_room_code ON games(room_code) WHERE status = 'waiting'",
+        # One row per user backs the activity-flush upsert
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_user_activity_user ON user_activity(user_id)',
+        # Newest-first story lookups (/history) without a full-table sort
+        'CREATE INDEX IF NOT EXISTS idx_story_history_created_at ON story_history(created_at DESC)',
+        # Status filters: the /start and /reset joins and the per-status
+        # stats GROUP BY all narrow on games.status
+        'CREATE INDEX IF NOT EXISTS idx_games_status ON games(status)',
+        # Most-recently-active listing in admin_stats
+        'CREATE INDEX IF NOT EXISTS idx_user_activity_last_action ON user_activity(last_action DESC)',
+    ):
         try:
-            cursor.execute('ALTER TABLE user_activity ADD COLUMN username TEXT')
-        except sqlite3.OperationalError:
+            cursor.execute(index_ddl)
+            conn.commit()
+        except Exception:
             pass
-    
+
+    # Warm the in-memory room registry so waiting rooms survive a restart
+    # without every first callback falling back to the DB
+    cursor.execute("SELECT room_code, game_id, created_by FROM games WHERE status = 'waiting'")
+    for room_code, game_id, created_by in cursor.fetchall():
+        waiting_rooms[room_code] = (game_id, created_by)
+    if waiting_rooms:
+        logger.info(f"Rehydrated {len(waiting_rooms)} waiting room(s)")
+
     conn.commit()
     conn.close()
+
+    # Prefill the pool so the first callbacks don't pay connection setup
+    try:
+        while not _conn_pool.full():
+            _conn_pool.put_nowait(_connect())
+    except queue.Full:
+        pass
+
     logger.info("Database initialized")
 
 
+def _log_user_activity_cursor(cursor, user_id, username=None, msk_time=None):
+    """Write user activity through an existing cursor (no commit).
+
+    msk_time lets batch callers format the timestamp once per flush
+    instead of once per row.
+    """
+    if msk_time is None:
+        msk_time = datetime.now(MSK).strftime('%Y-%m-%d %H:%M:%S')
+
+    # Single upsert against the unique user_id index instead of
+    # SELECT-then-UPDATE-or-INSERT
+    cursor.execute('''
+        INSERT INTO user_activity (user_id, username, last_action) VALUES (?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            username = excluded.username, last_action = excluded.last_action
+    ''', (user_id, username, msk_time))
+
+# Write-back buffer for activity logging: {user_id: username}, latest wins.
+# Handlers only touch the dict; a background task batches the DB writes.
+_activity_buffer = {}
+
+# Users logged within this window with an unchanged username are skipped,
+# so a chatty user costs ~one activity write per minute instead of one per message
+_ACTIVITY_DEDUP_WINDOW = 60
+_recently_logged = {}
+
 def log_user_activity(user_id, username=None):
-    """Log user activity timestamp"""
+    """Queue a user-activity update; flushed in batches off the hot path"""
+    now = time.monotonic()
+    last = _recently_logged.get(user_id)
+    if last and last[0] == username and now - last[1] < _ACTIVITY_DEDUP_WINDOW:
+        return
+    if len(_recently_logged) > 10000:
+        cutoff = now - _ACTIVITY_DEDUP_WINDOW
+        for uid in [uid for uid, (_, ts) in _recently_logged.items() if ts < cutoff]:
+            del _recently_logged[uid]
+    _recently_logged[user_id] = (username, now)
+    _activity_buffer[user_id] = username
+
+def flush_user_activity():
+    """Write all buffered activity rows in a single transaction"""
+    if not _activity_buffer:
+        return
+    pending = list(_activity_buffer.items())
+    _activity_buffer.clear()
     try:
-        conn = get_db_connection()
-        cursor = get_cursor(conn)
+        # One timestamp per batch; the rows land in the same commit anyway
         msk_time = datetime.now(MSK).strftime('%Y-%m-%d %H:%M:%S')
-        
-        cursor.execute('SELECT id FROM user_activity WHERE user_id = ?', (user_id,))
-        exists = cursor.fetchone()
-        
-        if exists:
-            cursor.execute('UPDATE user_activity SET last_action = ?, username = ? WHERE user_id = ?', (msk_time, username, user_id))
-        else:
-            cursor.execute('INSERT INTO user_activity (user_id, username, last_action) VALUES (?, ?, ?)', (user_id, username, msk_time))
-        
-        conn.commit()
-        conn.close()
+        with _write_lock:
+            conn = get_db_connection()
+            cursor = get_cursor(conn)
+            for user_id, username in pending:
+                _log_user_activity_cursor(cursor, user_id, username, msk_time)
+            conn.commit()
+            conn.close()
     except Exception as e:
-        logger.error(f'Error logging user activity: {e}')
+        logger.error(f'Error flushing user activity: {e}')
+
+async def activity_flush_task(app):
+    """Periodically flush the user-activity buffer.
+
+    Runs until cancelled at shutdown: post_init fires before
+    Application.start() sets running=True, so a `while app.running:`
+    loop would see False on its first step and exit immediately.
+    """
+    try:
+        while True:
+            await asyncio.sleep(2)
+            try:
+                await asyncio.to_thread(flush_user_activity)
+            except Exception as e:
+                logger.error(f'[ACTIVITY_FLUSH] Flush failed: {e}')
+    except asyncio.CancelledError:
+        logger.info('[ACTIVITY_FLUSH] Flush task cancelled')
+    flush_user_activity()
+
+def _db_fetchone(query, params=()):
+    """Run one read query on a pooled connection; safe to call via to_thread"""
+    conn = get_db_connection()
+    cursor = get_cursor(conn)
+    cursor.execute(query, params)
+    row = cursor.fetchone()
+    conn.close()
+    return row
+
+# Startup moment of this process; immutable for the process lifetime, so
+# /bot_uptime reads it from here instead of querying bot_sessions
+_bot_startup_time = None
 
 def log_bot_startup():
     """Log bot startup time to database in MSK"""
+    global _bot_startup_time
     try:
+        started_at = datetime.now(MSK)
         conn = get_db_connection()
         cursor = get_cursor(conn)
-        msk_time = datetime.now(MSK).strftime('%Y-%m-%d %H:%M:%S')
+        msk_time = started_at.strftime('%Y-%m-%d %H:%M:%S')
         if USE_POSTGRES:
             cursor.execute('INSERT INTO bot_sessions (started_at) VALUES (%s)', (msk_time,))
         else:
             cursor.execute('INSERT INTO bot_sessions (started_at) VALUES (?)', (msk_time,))
         conn.commit()
         conn.close()
+        _bot_startup_time = started_at
         logger.info('Bot startup logged to database')
     except Exception as e:
         logger.error(f'Error logging bot startup: {e}')
 
 def get_bot_uptime():
-    """Get bot startup time"""
+    """Get bot startup time (memoized after the first successful read)"""
+    global _bot_startup_time
+    if _bot_startup_time is not None:
+        return _bot_startup_time
+    # Fallback for the unlikely case the startup insert failed: read the
+    # last session row once and cache it
     try:
         conn = get_db_connection()
         cursor = get_cursor(conn)
-        if USE_POSTGRES:
-            cursor.execute('SELECT started_at FROM bot_sessions ORDER BY started_at DESC LIMIT 1')
-        else:
-            cursor.execute('SELECT started_at FROM bot_sessions ORDER BY started_at DESC LIMIT 1')
+        cursor.execute('SELECT started_at FROM bot_sessions ORDER BY started_at DESC LIMIT 1')
         result = cursor.fetchone()
         conn.close()
-        
+
         if not result:
             return None
-        
-        return result[0]
+
+        started_at = result[0]
+        if not isinstance(started_at, datetime):
+            started_at = datetime.strptime(str(started_at), '%Y-%m-%d %H:%M:%S')
+        if started_at.tzinfo is None:
+            started_at = started_at.replace(tzinfo=MSK)
+        _bot_startup_time = started_at
+        return _bot_startup_time
     except Exception as e:
         logger.error(f'Error getting bot uptime: {e}')
         return None
 
+def _lookup_waiting_room(cursor, room_code):
+    """Resolve a waiting room to (game_id, created_by), preferring the registry"""
+    cached = waiting_rooms.get(room_code)
+    if cached:
+        return cached
+    cursor.execute('''
+        SELECT game_id, created_by FROM games
+        WHERE room_code = ? AND status = 'waiting'
+    ''', (room_code,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    waiting_rooms[room_code] = (row[0], row[1])
+    return waiting_rooms[room_code]
+
+def _track_answer(game_id, question_idx, player_idx):
+    """Record an answer in the in-memory tracker.
+
+    Returns (total_players, answered_count), or None when the game is not
+    cached (e.g. after a bot restart) and the caller must count via SQL.
+    """
+    state = game_answer_state.get(game_id)
+    if state is None:
+        return None
+    state['answered'][question_idx].add(player_idx)
+    return state['total'], len(state['answered'][question_idx])
+
+async def _claim_question_advance(game_id, question_idx):
+    """Claim the right to advance the game past question_idx.
+
+    Returns True exactly once per (game, question); every later caller
+    gets False. Serialized on a per-game asyncio.Lock so two "last"
+    answers arriving together can't both kick off the next question.
+    """
+    async with GAME_LOCKS[game_id]:
+        done = _advanced_questions[game_id]
+        if question_idx in done:
+            return False
+        done.add(question_idx)
+        return True
+
+# 32 characters (power of two) with the ambiguous ones removed, so each
+# byte of os.urandom maps to a character with a single mask - no
+# Mersenne Twister state and no rejection sampling
+_ROOM_CODE_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+
 def generate_room_code():
     """Generate random room code"""
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))
+    return ''.join(_ROOM_CODE_ALPHABET[b & 31] for b in os.urandom(4))
 
 QUESTIONS = [
     "Какой?",
@@ -335,29 +634,43 @@ QUESTIONS = [
     "Что с ними стало?"
 ]
 
+# Placeholder answers for a player who never answered anything
+_NO_ANSWERS = ("—",) * len(QUESTIONS)
+
 WAITING_FOR_ANSWER = 1
 WAITING_FOR_ROOM_CODE = 2
 
+# Static keyboards and per-question texts, built once at import time
+# instead of on every send. InlineKeyboardMarkup objects are immutable
+# and safe to reuse across messages.
+ADMIN_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("▶️ Начать игру", callback_data='start_game')],
+    [InlineKeyboardButton("❌ Выйти", callback_data='leave_game')]
+])
+ADMIN_COMPLETED_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("▶️ Начать новую игру", callback_data='new_game')],
+    [InlineKeyboardButton("❌ Выйти", callback_data='leave_game')]
+])
+PLAYER_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("❌ Выйти", callback_data='leave_game')]
+])
+START_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎮 Новая игра", callback_data='new_game')],
+    [InlineKeyboardButton("🔑 Присоединиться по коду", callback_data='join_by_code')]
+])
+QUESTION_TEXTS = [
+    f"❓ <b>Вопрос {i + 1}/{len(QUESTIONS)}</b>\n\n<b>{q}</b>\n\n📝 <b>Напиши свой ответ в чат:</b>"
+    for i, q in enumerate(QUESTIONS)
+]
+
 async def bot_uptime(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show bot uptime"""
-    startup_time_str = get_bot_uptime()
-    if not startup_time_str:
+    # Already a tz-aware datetime; parsing happened once in get_bot_uptime
+    startup_time = get_bot_uptime()
+    if not startup_time:
         await update.message.reply_text("❌ Ошибка при получении информации о боте.")
         return
-    
-    try:
-        if isinstance(startup_time_str, datetime):
-            startup_time = startup_time_str
-            if startup_time.tzinfo is None:
-                startup_time = MSK.localize(startup_time)
-        else:
-            startup_time = datetime.strptime(str(startup_time_str), '%Y-%m-%d %H:%M:%S')
-            startup_time = MSK.localize(startup_time)
-    except Exception as e:
-        logger.error(f'Error processing uptime: {e}')
-        await update.message.reply_text("❌ Ошибка при обработке времени.")
-        return
-    
+
     now = datetime.now(MSK)
     uptime = now - startup_time
     
@@ -366,62 +679,135 @@ async def bot_uptime(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     minutes = (uptime.seconds % 3600) // 60
     seconds = uptime.seconds % 60
     
-    response = '⏱ <b>ИНФОРМАЦИЯ О БОТЕ (МСК)</b>\n\n'
-    response += f'🔄 Время запуска: {startup_time.strftime("%d.%m.%Y %H:%M:%S")}\n'
-    response += f'⌛ Время работы: {days}д {hours}ч {minutes}м {seconds}с'
-    
+    response = (
+        '⏱ <b>ИНФОРМАЦИЯ О БОТЕ (МСК)</b>\n\n'
+        f'🔄 Время запуска: {startup_time.strftime("%d.%m.%Y %H:%M:%S")}\n'
+        f'⌛ Время работы: {days}д {hours}ч {minutes}м {seconds}с'
+    )
+
     await update.message.reply_text(response, parse_mode='HTML')
 
+# The aggregate counts behind /stats change slowly; serve a cached
+# response for a short window instead of re-running eight COUNT queries
+_STATS_TTL = 30
+_stats_cache = {'time': 0.0, 'text': None}
+
+def _games_by_status(cursor):
+    """Count games per status in one scan instead of a query per status.
+
+    Returns (total_games, {status: count}).
+    """
+    cursor.execute('SELECT status, COUNT(*) FROM games GROUP BY status')
+    counts = {row[0]: row[1] for row in cursor.fetchall()}
+    return sum(counts.values()), counts
+
+def _db_collect_stats():
+    """Gather the aggregate numbers behind /stats (sync, run via to_thread)"""
+    conn = get_db_connection()
+    cursor = get_cursor(conn)
+
+    total_games, counts = _games_by_status(cursor)
+    waiting_games = counts.get('waiting', 0)
+    in_progress_games = counts.get('in_progress', 0)
+    completed_games = counts.get('completed', 0)
+    timeout_games = counts.get('aborted', 0)
+    reset_games = counts.get('reset', 0)
+
+    # Unique players and saved stories in a single round trip
+    cursor.execute('''
+        SELECT (SELECT COUNT(DISTINCT user_id) FROM user_activity),
+               (SELECT COUNT(*) FROM story_history)
+    ''')
+    total_players, total_stories = cursor.fetchone()
+
+    conn.close()
+    return (total_games, waiting_games, in_progress_games, completed_games,
+            timeout_games, reset_games, total_players, total_stories)
+
+# Admin stats cache; shorter TTL than /stats since the admin usually
+# wants fresher numbers, but repeated taps still skip the query set
+_ADMIN_STATS_TTL = 5
+_admin_stats_cache = {'time': 0.0, 'text': None}
+
+# Status -> (emoji, label) for the admin room list; unknown statuses
+# render as 'reset', matching the old else branch
+_STATUS_DISPLAY = {
+    'waiting': ('🔵', 'ожидание'),
+    'in_progress': ('🟣', 'в игре'),
+    'completed': ('🟢', 'завершена'),
+    'aborted': ('🔴', 'таймаут'),
+    'reset': ('⚫', 'сброс'),
+}
+
+def _db_collect_admin_stats():
+    """Gather everything behind /admin_stats (sync, run via to_thread)"""
+    conn = get_db_connection()
+    cursor = get_cursor(conn)
+
+    total_games, counts = _games_by_status(cursor)
+
+    # Last 10 rooms
+    cursor.execute('''
+        SELECT game_id, room_code, status, created_at, created_by FROM games
+        ORDER BY created_at DESC LIMIT 10
+    ''')
+    last_rooms = cursor.fetchall()
+
+    # Players for all listed rooms in one IN query instead of a
+    # SELECT per room (N+1)
+    players_by_game = defaultdict(list)
+    if last_rooms:
+        room_ids = [room[0] for room in last_rooms]
+        placeholders = ', '.join('?' * len(room_ids))
+        cursor.execute(f'''
+            SELECT game_id, username, first_name, is_admin FROM game_players
+            WHERE game_id IN ({placeholders}) ORDER BY is_admin DESC, joined_at ASC
+        ''', room_ids)
+        for row_game_id, username, first_name, is_admin in cursor.fetchall():
+            players_by_game[row_game_id].append((username, first_name, is_admin))
+
+    # Count in SQL and pull only the rows actually rendered, instead of
+    # fetching the whole activity table to len() it in Python
+    cursor.execute('SELECT COUNT(*) FROM user_activity')
+    unique_players = cursor.fetchone()[0]
+    cursor.execute('''
+        SELECT user_id, username, last_action FROM user_activity
+        ORDER BY last_action DESC LIMIT 10
+    ''')
+    recent_players = cursor.fetchall()
+
+    conn.close()
+    return total_games, counts, last_rooms, players_by_game, unique_players, recent_players
+
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show bot statistics"""
     user_id = update.effective_user.id
     username = update.effective_user.username or f"User{user_id}"
     log_user_activity(user_id, username)
-    
+
+    if _stats_cache['text'] and time.monotonic() - _stats_cache['time'] < _STATS_TTL:
+        await update.message.reply_text(_stats_cache['text'], parse_mode='HTML')
+        return
+
     try:
-        conn = get_db_connection()
-        cursor = get_cursor(conn)
-        
-        # Total games
-        cursor.execute('SELECT COUNT(*) FROM games')
-        total_games = cursor.fetchone()[0]
-        
-        # Games by status
-        cursor.execute("SELECT COUNT(*) FROM games WHERE status = ?", ('waiting',))
-        waiting_games = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM games WHERE status = ?", ('in_progress',))
-        in_progress_games = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM games WHERE status = ?", ('completed',))
-        completed_games = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM games WHERE status = ?", ('aborted',))
-        timeout_games = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM games WHERE status = ?", ('reset',))
-        reset_games = cursor.fetchone()[0]
-        
-        # Count unique players who have been in any game
-        cursor.execute('SELECT COUNT(DISTINCT user_id) FROM user_activity')
-        total_players = cursor.fetchone()[0]
-        
-        # Count total stories
-        cursor.execute('SELECT COUNT(*) FROM story_history')
-        total_stories = cursor.fetchone()[0]
-        
-        conn.close()
-        
-        response = "📊 <b>СТАТИСТИКА БОТА</b>\n\n"
-        response += f"🎮 <b>Всего игр:</b> {total_games}\n"
-        response += f"  🔵 Ожидание игроков: {waiting_games}\n"
-        response += f"  🟣 В игре: {in_progress_games}\n"
-        response += f"  🟢 Завершённые: {completed_games}\n"
-        response += f"  🔴 Прерваны (таймаут): {timeout_games}\n"
-        response += f"  ⚫ Прерваны (/reset): {reset_games}\n\n"
-        response += f"👥 <b>Уникальные игроки:</b> {total_players}\n\n"
-        response += f"📚 <b>Сохранено историй:</b> {total_stories}\n"
-        
+        (total_games, waiting_games, in_progress_games, completed_games,
+         timeout_games, reset_games, total_players, total_stories) = await asyncio.to_thread(_db_collect_stats)
+
+        response = (
+            "📊 <b>СТАТИСТИКА БОТА</b>\n\n"
+            f"🎮 <b>Всего игр:</b> {total_games}\n"
+            f"  🔵 Ожидание игроков: {waiting_games}\n"
+            f"  🟣 В игре: {in_progress_games}\n"
+            f"  🟢 Завершённые: {completed_games}\n"
+            f"  🔴 Прерваны (таймаут): {timeout_games}\n"
+            f"  ⚫ Прерваны (/reset): {reset_games}\n\n"
+            f"👥 <b>Уникальные игроки:</b> {total_players}\n\n"
+            f"📚 <b>Сохранено историй:</b> {total_stories}\n"
+        )
+
+        _stats_cache['text'] = response
+        _stats_cache['time'] = time.monotonic()
+
         await update.message.reply_text(response, parse_mode='HTML')
     except Exception as e:
         logger.error(f'Error getting stats: {e}')
@@ -437,78 +823,38 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     
     username = update.effective_user.username or f"User{user_id}"
     log_user_activity(user_id, username)
-    
+
+    # Short-lived cache so repeated taps don't rerun the aggregates
+    if _admin_stats_cache['text'] and time.monotonic() - _admin_stats_cache['time'] < _ADMIN_STATS_TTL:
+        await update.message.reply_text(_admin_stats_cache['text'], parse_mode='HTML')
+        return
+
     try:
-        conn = get_db_connection()
-        cursor = get_cursor(conn)
-        
-        # Total games
-        cursor.execute('SELECT COUNT(*) FROM games')
-        total_games = cursor.fetchone()[0]
-        
-        # Games by status
-        cursor.execute("SELECT COUNT(*) FROM games WHERE status = ?", ('waiting',))
-        waiting_games = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM games WHERE status = ?", ('in_progress',))
-        in_progress_games = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM games WHERE status = ?", ('completed',))
-        completed_games = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM games WHERE status = ?", ('aborted',))
-        timeout_games = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM games WHERE status = ?", ('reset',))
-        reset_games = cursor.fetchone()[0]
-        
-        # Last 10 rooms
-        cursor.execute('''
-            SELECT game_id, room_code, status, created_at, created_by FROM games 
-            ORDER BY created_at DESC LIMIT 10
-        ''')
-        last_rooms = cursor.fetchall()
-        
-        # Unique players with last activity
-        cursor.execute('''
-            SELECT user_id, username, last_action FROM user_activity 
-            ORDER BY last_action DESC
-        ''')
-        players_activity = cursor.fetchall()
-        
-        response = "👑 <b>АДМИНСКАЯ СТАТИСТИКА</b>\n\n"
-        response += f"🎮 <b>Всего игр:</b> {total_games}\n"
-        response += f"  🔵 Ожидание игроков: {waiting_games}\n"
-        response += f"  🟣 В игре: {in_progress_games}\n"
-        response += f"  🟢 Завершённые: {completed_games}\n"
-        response += f"  🔴 Прерваны (таймаут): {timeout_games}\n"
-        response += f"  ⚫ Прерваны (/reset): {reset_games}\n\n"
-        
-        response += f"📋 <b>ПОСЛЕДНИЕ 10 ИГР:</b>\n"
+        (total_games, counts, last_rooms, players_by_game,
+         unique_players, recent_players) = await asyncio.to_thread(_db_collect_admin_stats)
+        waiting_games = counts.get('waiting', 0)
+        in_progress_games = counts.get('in_progress', 0)
+        completed_games = counts.get('completed', 0)
+        timeout_games = counts.get('aborted', 0)
+        reset_games = counts.get('reset', 0)
+
+        # Collect fragments and join once - the old += chain reallocated
+        # the growing response string ~30 times per call
+        parts = [
+            "👑 <b>АДМИНСКАЯ СТАТИСТИКА</b>\n\n"
+            f"🎮 <b>Всего игр:</b> {total_games}\n"
+            f"  🔵 Ожидание игроков: {waiting_games}\n"
+            f"  🟣 В игре: {in_progress_games}\n"
+            f"  🟢 Завершённые: {completed_games}\n"
+            f"  🔴 Прерваны (таймаут): {timeout_games}\n"
+            f"  ⚫ Прерваны (/reset): {reset_games}\n\n"
+            "📋 <b>ПОСЛЕДНИЕ 10 ИГР:</b>\n"
+        ]
         for game_id, room_code, status, created_at, created_by in last_rooms:
-            if status == "waiting":
-                status_emoji = "🔵"
-                status_text = "ожидание"
-            elif status == "in_progress":
-                status_emoji = "🟣"
-                status_text = "в игре"
-            elif status == "completed":
-                status_emoji = "🟢"
-                status_text = "завершена"
-            elif status == "aborted":
-                status_emoji = "🔴"
-                status_text = "таймаут"
-            else:  # reset
-                status_emoji = "⚫"
-                status_text = "сброс"
-            
-            # Get players for this room
-            cursor.execute('''
-                SELECT username, first_name, is_admin FROM game_players 
-                WHERE game_id = ? ORDER BY is_admin DESC, joined_at ASC
-            ''', (game_id,))
-            players = cursor.fetchall()
-            
+            status_emoji, status_text = _STATUS_DISPLAY.get(status, _STATUS_DISPLAY['reset'])
+
+            players = players_by_game.get(game_id, [])
+
             # Format players list with admin marked
             players_list = []
             for username, first_name, is_admin in players:
@@ -517,79 +863,90 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
                     players_list.append(f"<b>{display_name}</b> 👑")
                 else:
                     players_list.append(display_name)
-            
+
             players_str = ", ".join(players_list) if players_list else "нет игроков"
-            response += f"  {status_emoji} {room_code} ({status_text})\n"
-            response += f"     👥 {players_str}\n"
-        
-        conn.close()
-        
-        response += f"\n👥 <b>УНИКАЛЬНЫЕ ИГРОКИ:</b> {len(players_activity)}\n"
-        response += f"<b>Последние 10 активных:</b>\n"
-        for user_id_act, username_act, last_action in players_activity[:10]:
+            parts.append(f"  {status_emoji} {room_code} ({status_text})\n"
+                         f"     👥 {players_str}\n")
+
+        parts.append(f"\n👥 <b>УНИКАЛЬНЫЕ ИГРОКИ:</b> {unique_players}\n"
+                     "<b>Последние 10 активных:</b>\n")
+        for user_id_act, username_act, last_action in recent_players:
             display_name = f"@{username_act}" if username_act else f"ID {user_id_act}"
-            response += f"  ▸ {display_name}: {last_action}\n"
-        
+            parts.append(f"  ▸ {display_name}: {last_action}\n")
+
+        response = "".join(parts)
+        _admin_stats_cache['text'] = response
+        _admin_stats_cache['time'] = time.monotonic()
+
         await update.message.reply_text(response, parse_mode='HTML')
     except Exception as e:
         logger.error(f'Error getting admin stats: {e}')
         await update.message.reply_text("❌ Ошибка при получении статистики.")
 
+# Static command responses, built once at import instead of being
+# re-concatenated on every call
+_ABOUT_TEXT = """ℹ️ <b>О БОТЕ</b>
+
+🤪 <b>Чепуха</b>
+Русскоязычный многопользовательский Telegram бот для игры в 'Чепуху' — весёлую партийную игру, где 2-6 игроков последовательно отвечают на вопросы, не видя ответов друг друга, создавая забавные истории.
+
+<b>👨‍💻 Разработчик:</b>
+<a href="https://t.me/DamirS16">@DamirS16</a>
+
+<b>📦 Исходный код:</b>
+<a href="https://github.com/Damir-Sayfullin/nonsense_game_bot">GitHub Repository</a>
+
+<b>🛠️ Технологии:</b>
+• Python 3.11+
+• python-telegram-bot 20.3
+• SQLite3 (разработка)
+• PostgreSQL (продакшн)
+• asyncio
+• zoneinfo
+
+<b>🚀 Функции:</b>
+• 🎮 Система комнат с 4-символьными кодами
+• ❓ 6 вопросов для каждой игры
+• 🎉 Ротированные истории для каждого игрока
+• 📊 Полная статистика и история игр
+• 👑 Система администраторов
+• ⏱️ 5-минутный таймаут на ответы
+"""
+
+_HELP_TEXT_USER = """📋 <b>ДОСТУПНЫЕ КОМАНДЫ:</b>
+
+<b>🎮 Игра:</b>
+/start - Начать новую игру
+/rules - Показать правила
+/history - Последние 10 историй
+/reset - Если игра сломалась (удаляет забагованную комнату)
+
+<b>ℹ️ Информация:</b>
+/bot_uptime - Время работы бота
+/stats - Статистика бота
+/about - О боте и разработчике
+"""
+
+_HELP_TEXT_ADMIN = _HELP_TEXT_USER + """
+<b>👑 Админ:</b>
+/admin_stats - Статистика для админа
+"""
+
 async def about(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show about bot information"""
     user_id = update.effective_user.id
     username = update.effective_user.username or f"User{user_id}"
     log_user_activity(user_id, username)
-    
-    response = "ℹ️ <b>О БОТЕ</b>\n\n"
-    response += "🤪 <b>Чепуха</b>\n"
-    response += "Русскоязычный многопользовательский Telegram бот для игры в 'Чепуху' — весёлую партийную игру, где 2-6 игроков последовательно отвечают на вопросы, не видя ответов друг друга, создавая забавные истории.\n\n"
-    
-    response += "<b>👨‍💻 Разработчик:</b>\n"
-    response += "<a href=\"https://t.me/DamirS16\">@DamirS16</a>\n\n"
-    
-    response += "<b>📦 Исходный код:</b>\n"
-    response += "<a href=\"https://github.com/Damir-Sayfullin/nonsense_game_bot\">GitHub Repository</a>\n\n"
-    
-    response += "<b>🛠️ Технологии:</b>\n"
-    response += "• Python 3.11+\n"
-    response += "• python-telegram-bot 20.3\n"
-    response += "• SQLite3 (разработка)\n"
-    response += "• PostgreSQL (продакшн)\n"
-    response += "• asyncio\n"
-    response += "• pytz\n\n"
-    
-    response += "<b>🚀 Функции:</b>\n"
-    response += "• 🎮 Система комнат с 4-символьными кодами\n"
-    response += "• ❓ 6 вопросов для каждой игры\n"
-    response += "• 🎉 Ротированные истории для каждого игрока\n"
-    response += "• 📊 Полная статистика и история игр\n"
-    response += "• 👑 Система администраторов\n"
-    response += "• ⏱️ 5-минутный таймаут на ответы\n"
-    
-    await update.message.reply_text(response, parse_mode='HTML')
+
+    await update.message.reply_text(_ABOUT_TEXT, parse_mode='HTML')
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show available commands"""
     user_id = update.effective_user.id
     username = update.effective_user.username or f"User{user_id}"
     log_user_activity(user_id, username)
-    
-    response = "📋 <b>ДОСТУПНЫЕ КОМАНДЫ:</b>\n\n"
-    response += "<b>🎮 Игра:</b>\n"
-    response += "/start - Начать новую игру\n"
-    response += "/rules - Показать правила\n"
-    response += "/history - Последние 10 историй\n"
-    response += "/reset - Если игра сломалась (удаляет забагованную комнату)\n\n"
-    response += "<b>ℹ️ Информация:</b>\n"
-    response += "/bot_uptime - Время работы бота\n"
-    response += "/stats - Статистика бота\n"
-    response += "/about - О боте и разработчике\n"
-    
-    if user_id == ADMIN_USER_ID:
-        response += "\n<b>👑 Админ:</b>\n"
-        response += "/admin_stats - Статистика для админа\n"
-    
+
+    response = _HELP_TEXT_ADMIN if user_id == ADMIN_USER_ID else _HELP_TEXT_USER
     await update.message.reply_text(response, parse_mode='HTML')
 
 async def history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -629,20 +986,15 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     username = update.effective_user.username or f"User{user_id}"
     log_user_activity(user_id, username)
     
-    # Check if user is in an active game
-    conn = get_db_connection()
-    cursor = get_cursor(conn)
-    
-    cursor.execute('''
+    # Check if user is in an active game; run the blocking read off the
+    # event loop so other updates keep flowing during disk I/O
+    result = await asyncio.to_thread(_db_fetchone, '''
         SELECT g.status FROM game_players gp
         JOIN games g ON gp.game_id = g.game_id
         WHERE gp.user_id = ? AND g.status != 'completed'
         LIMIT 1
     ''', (user_id,))
     
-    result = cursor.fetchone()
-    conn.close()
-    
     if result:
         await update.message.reply_text(
             "⏳ <b>Ты уже в игре!</b>\n\n"
@@ -652,15 +1004,10 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         )
         return
     
-    keyboard = [
-        [InlineKeyboardButton("🎮 Новая игра", callback_data='new_game')],
-        [InlineKeyboardButton("🔑 Присоединиться по коду", callback_data='join_by_code')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text(
         "🎮 Привет! Добро пожаловать в игру <b>Чепуха</b>!\n\n"
         "Весёлая игра для компании, где вы пишете слова и получается смешная история.",
-        reply_markup=reply_markup,
+        reply_markup=START_KB,
         parse_mode='HTML'
     )
 
@@ -713,39 +1060,64 @@ async def rules(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             parse_mode='HTML'
         )
 
-async def reset_game(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Reset broken game - delete room entirely (available for all players)"""
-    user_id = update.effective_user.id
-    
+def _db_reset_user_games(user_id):
+    """Delete the user's non-completed rooms (sync, run via to_thread).
+
+    Returns the list of deleted room codes, empty when there was nothing
+    to reset.
+    """
     conn = get_db_connection()
     cursor = get_cursor(conn)
-    
+
     # Find ONLY non-completed games where this user is playing
     cursor.execute('''
         SELECT g.game_id, g.room_code FROM games g
         JOIN game_players gp ON g.game_id = gp.game_id
         WHERE gp.user_id = ? AND g.status != ?
     ''', (user_id, 'completed'))
-    
+
     games = cursor.fetchall()
-    
+
     if not games:
-        await update.message.reply_text("❌ Нет активных комнат для сброса.\n\nВсе твои игры завершены или уже сброшены.")
         conn.close()
-        return
-    
-    # Delete active/broken games only (NOT completed ones)
+        return []
+
+    # Delete active/broken games only (NOT completed ones); one IN (...)
+    # statement per table and a single commit instead of four statements
+    # and an fsync per game
+    game_ids = [game[0] for game in games]
+    placeholders = ', '.join('?' * len(game_ids))
+    with _write_lock:
+        cursor.execute(f'DELETE FROM game_messages WHERE game_id IN ({placeholders})', game_ids)
+        cursor.execute(f'DELETE FROM game_answers WHERE game_id IN ({placeholders})', game_ids)
+        cursor.execute(f'DELETE FROM game_players WHERE game_id IN ({placeholders})', game_ids)
+        cursor.execute(f"UPDATE games SET status = 'reset' WHERE game_id IN ({placeholders})", game_ids)
+        conn.commit()
+    conn.close()
+
     deleted_rooms = []
+    drop_ids = set(game_ids)
     for game_id, room_code in games:
-        cursor.execute('DELETE FROM game_messages WHERE game_id = ?', (game_id,))
-        cursor.execute('DELETE FROM game_answers WHERE game_id = ?', (game_id,))
-        cursor.execute('DELETE FROM game_players WHERE game_id = ?', (game_id,))
-        cursor.execute('UPDATE games SET status = ? WHERE game_id = ?', ('reset', game_id))
+        game_answer_state.pop(game_id, None)
+        GAME_LOCKS.pop(game_id, None)
+        _advanced_questions.pop(game_id, None)
+        waiting_rooms.pop(room_code, None)
         deleted_rooms.append(room_code)
-    
-    conn.commit()
-    conn.close()
-    
+    for uid in [u for u, entry in awaiting_answer.items() if entry[0] in drop_ids]:
+        del awaiting_answer[uid]
+    return deleted_rooms
+
+async def reset_game(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Reset broken game - delete room entirely (available for all players)"""
+    user_id = update.effective_user.id
+
+    # The whole multi-delete transaction runs off the event loop
+    deleted_rooms = await asyncio.to_thread(_db_reset_user_games, user_id)
+
+    if not deleted_rooms:
+        await update.message.reply_text("❌ Нет активных комнат для сброса.\n\nВсе твои игры завершены или уже сброшены.")
+        return
+
     # Clear room code from context
     context.user_data.pop('room_code', None)
     context.user_data.pop('game_id', None)
@@ -757,21 +1129,21 @@ async def reset_game(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         parse_mode='HTML'
     )
 
+# Compiled once; parses 'answer_<game_id>_<question_idx>_<player_idx>' in one match
+_ANSWER_RE = re.compile(r'^answer_(\d+)_(\d+)_(\d+)$')
+
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle button clicks"""
     query = update.callback_query
     await query.answer()
-    
-    if query.data == 'new_game':
-        await start_new_game(query, context)
-    elif query.data == 'rules':
-        await rules(update, context)
-    elif query.data == 'join_by_code':
-        await ask_for_room_code(update, context)
-    elif query.data == 'start_game':
-        await start_game_session(query, context)
-    elif query.data == 'leave_game':
-        await leave_game(query, context)
+
+    answer_match = _ANSWER_RE.match(query.data)
+    if answer_match:
+        await handle_answer(update, context, *map(int, answer_match.groups()))
+        return
+    handler = _BUTTON_DISPATCH.get(query.data)
+    if handler:
+        await handler(update, context)
 
 def get_room_code_from_context(context):
     """Get room code from user context"""
@@ -781,22 +1153,6 @@ def set_room_code_in_context(context, code):
     """Set room code in user context"""
     context.user_data['room_code'] = code
 
-def get_players_list_text(game_id, conn):
-    """Get formatted player list with admin crown"""
-    cursor = get_cursor(conn)
-    cursor.execute('''
-        SELECT first_name, is_admin FROM game_players WHERE game_id = ? ORDER BY joined_at
-    ''', (game_id,))
-    players_data = cursor.fetchall()
-    
-    players_text = ""
-    for name, is_admin in players_data:
-        if is_admin:
-            players_text += f"• {name} 👑\n"
-        else:
-            players_text += f"• {name}\n"
-    return players_text.strip()
-
 async def update_room_players(game_id, room_code, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Update all players in room with current player list"""
     logger.info(f"[UPDATE_ROOM_PLAYERS] Called with game_id={game_id}, room_code={room_code}")
@@ -809,21 +1165,23 @@ async def update_room_players(game_id, room_code, context: ContextTypes.DEFAULT_
     game_status = game_status_row[0] if game_status_row else 'waiting'
     logger.info(f"[UPDATE_ROOM_PLAYERS] Game status: {game_status}")
     
-    # Get all players
+    # All players plus their stored room message in one JOIN instead of
+    # a follow-up message_id lookup per player (N+1)
     cursor.execute('''
-        SELECT user_id, first_name, is_admin FROM game_players WHERE game_id = ? ORDER BY joined_at
+        SELECT p.user_id, p.first_name, p.is_admin, m.message_id
+        FROM game_players p
+        LEFT JOIN game_messages m ON m.game_id = p.game_id AND m.user_id = p.user_id
+        WHERE p.game_id = ?
+        ORDER BY p.joined_at
     ''', (game_id,))
     players_data = cursor.fetchall()
-    logger.info(f"[UPDATE_ROOM_PLAYERS] Found {len(players_data)} players: {players_data}")
-    
-    # Build player list text
-    players_list = ""
-    for first_name, is_admin in [(p[1], p[2]) for p in players_data]:
-        if is_admin:
-            players_list += f"• {first_name} 👑\n"
-        else:
-            players_list += f"• {first_name}\n"
-    players_list = players_list.strip()
+    logger.info(f"[UPDATE_ROOM_PLAYERS] Found {len(players_data)} players")
+
+    # Build player list text in one pass with named column access
+    players_list = "\n".join(
+        f"• {row['first_name']} 👑" if row['is_admin'] else f"• {row['first_name']}"
+        for row in players_data
+    )
     logger.info(f"[UPDATE_ROOM_PLAYERS] Player list text:\n{players_list}")
     
     # If game is completed, delete old messages to force sending new ones
@@ -832,52 +1190,33 @@ async def update_room_players(game_id, room_code, context: ContextTypes.DEFAULT_
         cursor.execute('DELETE FROM game_messages WHERE game_id = ?', (game_id,))
         conn.commit()
     
-    # Update each player
-    for user_id, first_name, is_admin in players_data:
-        logger.info(f"[UPDATE_ROOM_PLAYERS] Processing player {first_name} (user_id={user_id}, is_admin={is_admin})")
+    # The room text is the same for everyone - build it once
+    if game_status == 'completed':
+        message_text = f"🎉 <b>Игра закончена!</b>\n\n" \
+                      f"🔑 Код комнаты: <code>{room_code}</code>\n\n" \
+                      f"👥 Игроки ({len(players_data)}):\n{players_list}"
+    else:
+        message_text = f"🎮 <b>Комната создана!</b>\n\n" \
+                      f"🔑 Код комнаты: <code>{room_code}</code>\n\n" \
+                      f"👥 Игроки ({len(players_data)}):\n{players_list}\n\n" \
+                      f"Скажи друзьям этот код, чтобы они присоединились!"
+
+    async def _update_one(user_id, first_name, is_admin, message_id):
+        """Edit one player's room message (or send a new one).
+
+        Returns the new message id when a fresh message was sent, else None.
+        """
         if is_admin:
-            if game_status == 'completed':
-                keyboard = [
-                    [InlineKeyboardButton("▶️ Начать новую игру", callback_data='new_game')],
-                    [InlineKeyboardButton("❌ Выйти", callback_data='leave_game')]
-                ]
-            else:
-                # Game is waiting - show start game button
-                keyboard = [
-                    [InlineKeyboardButton("▶️ Начать игру", callback_data='start_game')],
-                    [InlineKeyboardButton("❌ Выйти", callback_data='leave_game')]
-                ]
-        else:
-            keyboard = [
-                [InlineKeyboardButton("❌ Выйти", callback_data='leave_game')]
-            ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        # Different message text based on game status
-        if game_status == 'completed':
-            message_text = f"🎉 <b>Игра закончена!</b>\n\n" \
-                          f"🔑 Код комнаты: <code>{room_code}</code>\n\n" \
-                          f"👥 Игроки ({len(players_data)}):\n{players_list}"
+            reply_markup = ADMIN_COMPLETED_KB if game_status == 'completed' else ADMIN_KB
         else:
-            message_text = f"🎮 <b>Комната создана!</b>\n\n" \
-                          f"🔑 Код комнаты: <code>{room_code}</code>\n\n" \
-                          f"👥 Игроки ({len(players_data)}):\n{players_list}\n\n" \
-                          f"Скажи друзьям этот код, чтобы они присоединились!"
-        
-        logger.info(f"[UPDATE_ROOM_PLAYERS] Message text for {first_name}:\n{message_text}")
-        
-        # Check if we have an existing message for this user
-        cursor.execute('''
-            SELECT message_id FROM game_messages WHERE game_id = ? AND user_id = ?
-        ''', (game_id, user_id))
-        message_row = cursor.fetchone()
-        logger.info(f"[UPDATE_ROOM_PLAYERS] Existing message_row for user {user_id}: {message_row}")
-        
+            reply_markup = PLAYER_KB
+
         try:
-            if message_row and game_status != 'completed':
+            if message_id and game_status != 'completed':
+                if _last_room_text.get(user_id) == message_text:
+                    # Nothing changed for this user - skip the round trip
+                    return None
                 # Edit existing message only if game is not completed
-                message_id = message_row[0]
                 logger.info(f"[UPDATE_ROOM_PLAYERS] Editing message {message_id} for user {user_id}")
                 await context.bot.edit_message_text(
                     chat_id=user_id,
@@ -886,28 +1225,81 @@ async def update_room_players(game_id, room_code, context: ContextTypes.DEFAULT_
                     reply_markup=reply_markup,
                     parse_mode='HTML'
                 )
-                logger.info(f"[UPDATE_ROOM_PLAYERS] Successfully edited message for user {user_id}")
-            else:
-                # Send new message and store message ID
-                logger.info(f"[UPDATE_ROOM_PLAYERS] Sending new message to user {user_id}")
-                msg = await context.bot.send_message(
-                    chat_id=user_id,
-                    text=message_text,
-                    reply_markup=reply_markup,
-                    parse_mode='HTML'
-                )
-                logger.info(f"[UPDATE_ROOM_PLAYERS] Message sent with ID {msg.message_id}")
-                cursor.execute('''
-                    INSERT INTO game_messages (game_id, user_id, message_id)
-                    VALUES (?, ?, ?)
-                ''', (game_id, user_id, msg.message_id))
-                conn.commit()
+                _last_room_text[user_id] = message_text
+                return None
+            # Send new message and store message ID afterwards
+            logger.info(f"[UPDATE_ROOM_PLAYERS] Sending new message to user {user_id}")
+            msg = await context.bot.send_message(
+                chat_id=user_id,
+                text=message_text,
+                reply_markup=reply_markup,
+                parse_mode='HTML'
+            )
+            _last_room_text[user_id] = message_text
+            return msg.message_id
         except TelegramError as e:
             logger.error(f"[UPDATE_ROOM_PLAYERS] Failed to update message for {user_id}: {e}")
-    
+            return None
+
+    # Fan all edits/sends out together so the broadcast costs ~one
+    # Telegram round-trip instead of N
+    results = await asyncio.gather(*[
+        _tg_call(_update_one, row['user_id'], row['first_name'], row['is_admin'],
+                 row['message_id'] if game_status != 'completed' else None)
+        for row in players_data
+    ])
+
+    new_rows = [
+        (game_id, row['user_id'], new_message_id)
+        for row, new_message_id in zip(players_data, results)
+        if new_message_id is not None
+    ]
+    if new_rows:
+        cursor.executemany(SQL_UPSERT_GAME_MESSAGE, new_rows)
+        conn.commit()
+
     logger.info(f"[UPDATE_ROOM_PLAYERS] Completed for game_id={game_id}")
     conn.close()
 
+def _db_create_room(conn, user_id, username, first_name):
+    """Insert a new game and its creator row (runs in a worker thread).
+
+    Returns (game_id, room_code), or None after repeated code collisions.
+    The creation commits atomically here; the connection is left open for
+    the follow-up message-id write.
+    """
+    cursor = get_cursor(conn)
+    room_code = generate_room_code()
+
+    with _write_lock:
+        # RETURNING works on both backends (SQLite >= 3.35), so no branching
+        # and no lastrowid round trip. Regenerate the code on the (rare)
+        # collision with an existing room instead of failing the handler.
+        for attempt in range(3):
+            try:
+                cursor.execute('''
+                    INSERT INTO games (room_code, created_by, status, current_question_idx)
+                    VALUES (?, ?, ?, ?)
+                    RETURNING game_id
+                ''', (room_code, user_id, 'waiting', 0))
+                game_id = cursor.fetchone()[0]
+                break
+            except _INTEGRITY_ERRORS:
+                # Postgres aborts the transaction on the failed INSERT,
+                # so roll back before retrying with a fresh code
+                conn.rollback()
+                room_code = generate_room_code()
+        else:
+            return None
+
+        cursor.execute('''
+            INSERT INTO game_players (game_id, user_id, username, first_name, is_admin)
+            VALUES (?, ?, ?, ?, 1)
+        ''', (game_id, user_id, username, first_name))
+        conn.commit()
+
+    return game_id, room_code
+
 async def start_new_game(query, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Create a new game"""
     room_code = get_room_code_from_context(context)
@@ -932,64 +1324,38 @@ async def start_new_game(query, context: ContextTypes.DEFAULT_TYPE) -> None:
         context.user_data.pop('room_code', None)
     
     # Otherwise, create a brand new game
-    room_code = generate_room_code()
-    
     conn = get_db_connection()
-    cursor = get_cursor(conn)
-    
-    user_id = query.from_user.id
-    
-    if USE_POSTGRES:
-        cursor.execute('''
-            INSERT INTO games (room_code, created_by, status, current_question_idx)
-            VALUES (%s, %s, %s, %s)
-            RETURNING game_id
-        ''', (room_code, user_id, 'waiting', 0))
-        game_id = cursor.fetchone()[0]
-    else:
-        cursor.execute('''
-            INSERT INTO games (room_code, created_by, status, current_question_idx)
-            VALUES (?, ?, ?, ?)
-        ''', (room_code, user_id, 'waiting', 0))
-        game_id = cursor.lastrowid
-    
-    cursor.execute('''
-        INSERT INTO game_players (game_id, user_id, username, first_name, is_admin)
-        VALUES (?, ?, ?, ?, 1)
-    ''', (game_id, user_id, query.from_user.username, query.from_user.first_name))
-    
-    conn.commit()
-    conn.close()
-    
+
+    created = await asyncio.to_thread(
+        _db_create_room, conn, user_id,
+        query.from_user.username, query.from_user.first_name)
+    if created is None:
+        conn.close()
+        await query.edit_message_text("❌ Не удалось создать комнату, попробуй ещё раз.")
+        return
+
+    game_id, room_code = created
+
+    waiting_rooms[room_code] = (game_id, user_id)
     set_room_code_in_context(context, room_code)
     context.user_data['game_id'] = game_id
-    
-    keyboard = [
-        [InlineKeyboardButton("▶️ Начать игру", callback_data='start_game')],
-        [InlineKeyboardButton("❌ Выйти", callback_data='leave_game')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
+
     message = await query.edit_message_text(
         text=f"🎮 <b>Комната создана!</b>\n\n"
              f"🔑 Код комнаты: <code>{room_code}</code>\n\n"
              f"👥 Игроки (1):\n"
              f"• {query.from_user.first_name} 👑\n\n"
              f"Скажи друзьям этот код, чтобы они присоединились!",
-        reply_markup=reply_markup,
+        reply_markup=ADMIN_KB,
         parse_mode='HTML'
     )
-    
-    # Store message ID for future edits
-    conn = get_db_connection()
-    cursor = get_cursor(conn)
-    cursor.execute('''
-        INSERT INTO game_messages (game_id, user_id, message_id)
-        VALUES (?, ?, ?)
-    ''', (game_id, query.from_user.id, message.message_id))
-    conn.commit()
-    conn.close()
-    
+
+    # Store message ID on the same pooled connection as its own short
+    # transaction, so the game rows aren't held open across the
+    # Telegram round trip
+    await asyncio.to_thread(
+        _db_record_join_message, conn, game_id, user_id, message.message_id)
+
     context.user_data['creator_message_id'] = message.message_id
 
 async def start_new_game_in_room(query, context: ContextTypes.DEFAULT_TYPE, room_code: str) -> None:
@@ -997,61 +1363,53 @@ async def start_new_game_in_room(query, context: ContextTypes.DEFAULT_TYPE, room
     conn = get_db_connection()
     cursor = get_cursor(conn)
     
+    # Game id and creator in one lookup instead of two
     cursor.execute('''
-        SELECT game_id FROM games WHERE room_code = ? AND status = 'completed'
+        SELECT game_id, created_by FROM games WHERE room_code = ? AND status = 'completed'
     ''', (room_code,))
-    
+
     result = cursor.fetchone()
     if not result:
         conn.close()
         await query.edit_message_text("❌ Не удалось начать новую игру")
         return
-    
-    old_game_id = result[0]
-    
-    cursor.execute('''
-        SELECT created_by FROM games WHERE game_id = ?
-    ''', (old_game_id,))
-    created_by = cursor.fetchone()[0]
-    
+
+    old_game_id, created_by = result
+
     # Copy players from old game to preserve admin status
     cursor.execute('''
-        SELECT user_id, username, first_name, is_admin FROM game_players 
+        SELECT user_id, username, first_name, is_admin FROM game_players
         WHERE game_id = ? ORDER BY joined_at
     ''', (old_game_id,))
     players = cursor.fetchall()
-    
-    # Delete old game data to free up the room_code for reuse
-    cursor.execute('DELETE FROM game_messages WHERE game_id = ?', (old_game_id,))
-    cursor.execute('DELETE FROM game_answers WHERE game_id = ?', (old_game_id,))
-    cursor.execute('DELETE FROM game_players WHERE game_id = ?', (old_game_id,))
-    cursor.execute('DELETE FROM games WHERE game_id = ?', (old_game_id,))
-    
-    # Create new game with same room code
-    if USE_POSTGRES:
+
+    # Delete the old game, recreate it and copy the players back in a
+    # single write transaction - one commit for the whole room swap
+    with _write_lock:
+        cursor.execute('DELETE FROM game_messages WHERE game_id = ?', (old_game_id,))
+        cursor.execute('DELETE FROM game_answers WHERE game_id = ?', (old_game_id,))
+        cursor.execute('DELETE FROM game_players WHERE game_id = ?', (old_game_id,))
+        cursor.execute('DELETE FROM games WHERE game_id = ?', (old_game_id,))
+
+        # Create new game with same room code
         cursor.execute('''
             INSERT INTO games (room_code, created_by, status, current_question_idx)
-            VALUES (%s, %s, %s, %s)
+            VALUES (?, ?, ?, ?)
             RETURNING game_id
         ''', (room_code, created_by, 'waiting', 0))
         new_game_id = cursor.fetchone()[0]
-    else:
-        cursor.execute('''
-            INSERT INTO games (room_code, created_by, status, current_question_idx)
-            VALUES (?, ?, ?, ?)
-        ''', (room_code, created_by, 'waiting', 0))
-        new_game_id = cursor.lastrowid
-    
-    # Add players to new game with preserved admin status
-    for user_id, username, first_name, is_admin in players:
-        cursor.execute('''
+
+        # Add players to new game with preserved admin status
+        cursor.executemany('''
             INSERT INTO game_players (game_id, user_id, username, first_name, is_admin)
             VALUES (?, ?, ?, ?, ?)
-        ''', (new_game_id, user_id, username, first_name, is_admin))
-    
-    conn.commit()
+        ''', [(new_game_id, user_id, username, first_name, is_admin)
+              for user_id, username, first_name, is_admin in players])
+
+        conn.commit()
     conn.close()
-    
+
+    waiting_rooms[room_code] = (new_game_id, created_by)
     context.user_data['game_id'] = new_game_id
     await query.edit_message_text("🎮 <b>Новая игра начинается в той же комнате!</b>\n\nЖди, когда админ начнёт игру.")
     
@@ -1075,6 +1433,47 @@ async def ask_for_room_code(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
     return WAITING_FOR_ROOM_CODE
 
+def _db_join_room(conn, room_code, user_id, username, first_name):
+    """Look up a waiting room and add the player (runs in a worker thread).
+
+    Returns None if the room is gone, otherwise (game_id, is_new_member).
+    The join commits atomically here; the connection is left open for the
+    follow-up message-id write.
+    """
+    cursor = get_cursor(conn)
+
+    result = _lookup_waiting_room(cursor, room_code)
+    if not result:
+        return None
+
+    game_id = result[0]
+
+    with _write_lock:
+        # Take the write lock up front so the membership check and the
+        # insert are one atomic transaction
+        if not USE_POSTGRES:
+            cursor.execute('BEGIN IMMEDIATE')
+
+        # Check-then-insert collapsed into one statement: the unique
+        # (game_id, user_id) index turns a duplicate join into a no-op
+        cursor.execute('''
+            INSERT INTO game_players (game_id, user_id, username, first_name, is_admin)
+            VALUES (?, ?, ?, ?, 0)
+            ON CONFLICT (game_id, user_id) DO NOTHING
+        ''', (game_id, user_id, username, first_name))
+        is_new_member = cursor.rowcount != 0
+        conn.commit()
+
+    return game_id, is_new_member
+
+def _db_record_join_message(conn, game_id, user_id, message_id):
+    """Replace the stored room message for a player and commit the join."""
+    with _write_lock:
+        cursor = get_cursor(conn)
+        cursor.execute(SQL_UPSERT_GAME_MESSAGE, (game_id, user_id, message_id))
+        conn.commit()
+        conn.close()
+
 async def receive_room_code(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Receive room code and join game"""
     if not update.message or not update.message.text:
@@ -1086,67 +1485,38 @@ async def receive_room_code(update: Update, context: ContextTypes.DEFAULT_TYPE)
     log_user_activity(user_id, username)
     
     conn = get_db_connection()
-    cursor = get_cursor(conn)
-    
-    cursor.execute('''
-        SELECT game_id FROM games 
-        WHERE room_code = ? AND status = 'waiting'
-    ''', (room_code,))
-    
-    result = cursor.fetchone()
-    if not result:
+
+    joined = await asyncio.to_thread(
+        _db_join_room, conn, room_code, user_id,
+        update.effective_user.username, update.effective_user.first_name)
+    if joined is None:
         await update.message.reply_text("❌ Комната не найдена или игра уже началась.")
         conn.close()
         return ConversationHandler.END
-    
-    game_id = result[0]
-    
-    cursor.execute('''
-        SELECT COUNT(*) FROM game_players 
-        WHERE game_id = ? AND user_id = ?
-    ''', (game_id, user_id))
-    
-    if cursor.fetchone()[0] > 0:
+
+    game_id, is_new_member = joined
+    if not is_new_member:
         await update.message.reply_text("❌ Ты уже в этой игре!")
         conn.close()
         return ConversationHandler.END
-    
-    cursor.execute('''
-        INSERT INTO game_players (game_id, user_id, username, first_name, is_admin)
-        VALUES (?, ?, ?, ?, 0)
-    ''', (game_id, user_id, update.effective_user.username, update.effective_user.first_name))
-    
-    conn.commit()
-    conn.close()
-    
+
     set_room_code_in_context(context, room_code)
     context.user_data['game_id'] = game_id
     
     # Send confirmation message first
-    keyboard = [
-        [InlineKeyboardButton("❌ Выйти", callback_data='leave_game')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     message = await update.message.reply_text(
         text=f"🎮 <b>Присоединился!</b>\n\n"
              f"🔑 Код: <code>{room_code}</code>\n\n"
              f"Жди, когда начнётся игра!",
-        reply_markup=reply_markup,
+        reply_markup=PLAYER_KB,
         parse_mode='HTML'
     )
     
-    # Store message ID for this player (delete old one first if exists)
-    conn = get_db_connection()
-    cursor = get_cursor(conn)
-    cursor.execute('DELETE FROM game_messages WHERE game_id = ? AND user_id = ?', (game_id, user_id))
-    cursor.execute('''
-        INSERT INTO game_messages (game_id, user_id, message_id)
-        VALUES (?, ?, ?)
-    ''', (game_id, user_id, message.message_id))
-    conn.commit()
-    conn.close()
-    
+    # Store message ID for this player on the same pooled connection,
+    # fsynced off the event loop
+    await asyncio.to_thread(
+        _db_record_join_message, conn, game_id, user_id, message.message_id)
+
     logger.info(f"[RECEIVE_ROOM_CODE] Player {user_id} joined game {game_id} with code {room_code}, message_id={message.message_id}")
     
     # Update room players - will edit the message we just sent
@@ -1154,65 +1524,81 @@ async def receive_room_code(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     return ConversationHandler.END
 
+def _db_leave_room(room_code, user_id):
+    """Remove a player from a waiting room (runs in a worker thread).
+
+    Returns None if the room is gone, otherwise (game_id, outcome) where
+    outcome is 'deleted', 'admin_handoff' or 'left'.
+    """
+    conn = get_db_connection()
+    cursor = get_cursor(conn)
+
+    result = _lookup_waiting_room(cursor, room_code)
+    if not result:
+        conn.close()
+        return None
+
+    game_id, created_by = result
+
+    with _write_lock:
+        cursor.execute('''
+            DELETE FROM game_players WHERE game_id = ? AND user_id = ?
+        ''', (game_id, user_id))
+        awaiting_answer.pop(user_id, None)
+        _last_room_text.pop(user_id, None)
+
+        # Remaining count and the would-be successor in one statement
+        cursor.execute('''
+            SELECT
+                (SELECT COUNT(*) FROM game_players WHERE game_id = ?),
+                (SELECT user_id FROM game_players WHERE game_id = ? ORDER BY joined_at LIMIT 1),
+                (SELECT id FROM game_players WHERE game_id = ? ORDER BY joined_at LIMIT 1)
+        ''', (game_id, game_id, game_id))
+        player_count, new_creator_id, new_creator_player_id = cursor.fetchone()
+
+        if player_count == 0:
+            cursor.execute('DELETE FROM game_messages WHERE game_id = ?', (game_id,))
+            cursor.execute('DELETE FROM games WHERE game_id = ?', (game_id,))
+            waiting_rooms.pop(room_code, None)
+            outcome = 'deleted'
+        elif user_id == created_by:
+            cursor.execute('UPDATE games SET created_by = ? WHERE game_id = ?', (new_creator_id, game_id))
+            cursor.execute('UPDATE game_players SET is_admin = 1 WHERE id = ?', (new_creator_player_id,))
+            waiting_rooms[room_code] = (game_id, new_creator_id)
+            outcome = 'admin_handoff'
+        else:
+            outcome = 'left'
+
+        # Не удаляем game_messages - это позволяет отредактировать старое сообщение при присоединении
+        conn.commit()
+        conn.close()
+        return game_id, outcome
+
 async def leave_game(query, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Leave the game room"""
     room_code = get_room_code_from_context(context)
     user_id = query.from_user.id
-    
+
     if not room_code:
         await query.edit_message_text("❌ Комната не найдена")
         return
-    
-    conn = get_db_connection()
-    cursor = get_cursor(conn)
-    
-    cursor.execute('''
-        SELECT game_id, created_by FROM games 
-        WHERE room_code = ? AND status = 'waiting'
-    ''', (room_code,))
-    
-    result = cursor.fetchone()
-    if not result:
+
+    # All the DB work (including the commit fsync) runs off the event loop
+    outcome = await asyncio.to_thread(_db_leave_room, room_code, user_id)
+    if outcome is None:
         await query.edit_message_text("❌ Комната не найдена или игра уже началась")
-        conn.close()
         return
-    
-    game_id, created_by = result
-    
-    cursor.execute('''
-        DELETE FROM game_players WHERE game_id = ? AND user_id = ?
-    ''', (game_id, user_id))
-    
-    cursor.execute('SELECT COUNT(*) FROM game_players WHERE game_id = ?', (game_id,))
-    player_count = cursor.fetchone()[0]
-    
-    if player_count == 0:
-        cursor.execute('DELETE FROM game_messages WHERE game_id = ?', (game_id,))
-        cursor.execute('DELETE FROM games WHERE game_id = ?', (game_id,))
+
+    game_id, what_happened = outcome
+    if what_happened == 'deleted':
         await query.edit_message_text("👋 Ты вышел из комнаты. Комната удалена.")
-        conn.commit()
-        conn.close()
     else:
-        if user_id == created_by:
-            cursor.execute('''
-                SELECT user_id, id FROM game_players WHERE game_id = ? ORDER BY joined_at LIMIT 1
-            ''', (game_id,))
-            new_creator_data = cursor.fetchone()
-            new_creator_id = new_creator_data[0]
-            new_creator_player_id = new_creator_data[1]
-            
-            cursor.execute('UPDATE games SET created_by = ? WHERE game_id = ?', (new_creator_id, game_id))
-            cursor.execute('UPDATE game_players SET is_admin = 1 WHERE id = ?', (new_creator_player_id,))
+        if what_happened == 'admin_handoff':
             await query.edit_message_text("👋 Ты вышел из комнаты. Новый создатель - следующий игрок.")
         else:
             await query.edit_message_text("👋 Ты вышел из комнаты.")
-        
-        # Не удаляем game_messages - это позволяет отредактировать старое сообщение при присоединении
-        conn.commit()
-        conn.close()
-        
         await update_room_players(game_id, room_code, context)
-    
+
     context.user_data.pop('room_code', None)
 
 async def start_game_session(query, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -1226,17 +1612,12 @@ async def start_game_session(query, context: ContextTypes.DEFAULT_TYPE) -> None:
     
     conn = get_db_connection()
     cursor = get_cursor(conn)
-    
-    cursor.execute('''
-        SELECT game_id, created_by FROM games 
-        WHERE room_code = ? AND status = 'waiting'
-    ''', (room_code,))
-    
-    result = cursor.fetchone()
+
+    result = _lookup_waiting_room(cursor, room_code)
     if not result:
         conn.close()
         return
-    
+
     game_id, created_by = result
     
     if user_id != created_by:
@@ -1254,44 +1635,60 @@ async def start_game_session(query, context: ContextTypes.DEFAULT_TYPE) -> None:
         ''', (game_id,))
         players = cursor.fetchall()
         
-        players_list = ""
-        for first_name, is_admin in players:
-            if is_admin:
-                players_list += f"• {first_name} 👑\n"
-            else:
-                players_list += f"• {first_name}\n"
-        players_list = players_list.strip()
-        
+        players_list = "\n".join(
+            f"• {first_name} 👑" if is_admin else f"• {first_name}"
+            for first_name, is_admin in players
+        )
+
         # Edit message to show error but keep room info
         error_message = f"🎮 <b>Комната создана!</b>\n\n" \
                        f"🔑 Код комнаты: <code>{room_code}</code>\n\n" \
                        f"👥 Игроки ({len(players)}):\n{players_list}\n\n" \
                        f"⚠️ <b>Нужно минимум 2 игрока для начала игры.</b>"
         
-        keyboard = [
-            [InlineKeyboardButton("▶️ Начать игру", callback_data='start_game')],
-            [InlineKeyboardButton("❌ Выйти", callback_data='leave_game')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
         conn.commit()
         conn.close()
-        
-        await query.edit_message_text(error_message, reply_markup=reply_markup, parse_mode='HTML')
+
+        await query.edit_message_text(error_message, reply_markup=ADMIN_KB, parse_mode='HTML')
         return
     
     cursor.execute('''
         UPDATE games SET status = 'in_progress', current_question_idx = 0
         WHERE game_id = ?
     ''', (game_id,))
-    
+    waiting_rooms.pop(room_code, None)
+
+    # Pre-create one empty answer row per (question, player) so each
+    # submitted answer becomes an in-place UPDATE instead of an insert
+    # that grows the table mid-game
+    cursor.execute('SELECT id FROM game_players WHERE game_id = ?', (game_id,))
+    player_row_ids = [row[0] for row in cursor.fetchall()]
+    cursor.executemany('''
+        INSERT INTO game_answers (game_id, question_idx, player_idx, answer)
+        VALUES (?, ?, ?, NULL)
+    ''', [(game_id, q, p) for q in range(len(QUESTIONS)) for p in player_row_ids])
+
     conn.commit()
     conn.close()
+
+    # Seed the in-memory answer tracker for this round
+    game_answer_state[game_id] = {'total': player_count, 'answered': [set() for _ in QUESTIONS]}
     
     await query.edit_message_text("🎮 Игра начинается!\n\nПроверьте личные сообщения для ответа на первый вопрос.")
     
     await send_question_to_players(game_id, 0, context)
 
+# Constant-time dispatch for button_handler instead of an if/elif scan.
+# Some handlers take the callback query, others the whole update, so the
+# query-based ones get a small adapter.
+_BUTTON_DISPATCH = {
+    'new_game': lambda update, context: start_new_game(update.callback_query, context),
+    'rules': rules,
+    'join_by_code': ask_for_room_code,
+    'start_game': lambda update, context: start_game_session(update.callback_query, context),
+    'leave_game': lambda update, context: leave_game(update.callback_query, context),
+}
+
 async def end_game_due_to_inactivity(game_id, inactive_user_id, inactive_first_name, context: ContextTypes.DEFAULT_TYPE) -> None:
     """End game because a player was inactive"""
     logger.info(f"[INACTIVITY] Ending game {game_id} due to inactivity of {inactive_first_name}")
@@ -1314,9 +1711,6 @@ async def end_game_due_to_inactivity(game_id, inactive_user_id, inactive_first_n
     all_players = cursor.fetchall()
     
     # Find players who haven't answered current question
-    cursor.execute('''
-        SELECT g.game_id FROM games g WHERE g.game_id = ?
-    ''', (game_id,))
     cursor.execute('''
         SELECT current_question_idx FROM games WHERE game_id = ?
     ''', (game_id,))
@@ -1336,9 +1730,14 @@ async def end_game_due_to_inactivity(game_id, inactive_user_id, inactive_first_n
     
     # Delete inactive players
     cursor.execute('DELETE FROM game_players WHERE game_id = ?', (game_id,))
+    for player_user_id, _ in all_players:
+        awaiting_answer.pop(player_user_id, None)
     cursor.execute('UPDATE games SET status = ? WHERE game_id = ?', ('aborted', game_id))
     conn.commit()
     conn.close()
+    game_answer_state.pop(game_id, None)
+    GAME_LOCKS.pop(game_id, None)
+    _advanced_questions.pop(game_id, None)
     
     # Create message with all inactive players listed with commas
     inactive_list = ", ".join(f"<b>{name}</b>" for name in inactive_players)
@@ -1351,52 +1750,32 @@ async def end_game_due_to_inactivity(game_id, inactive_user_id, inactive_first_n
         except TelegramError as e:
             logger.error(f"Failed to notify {first_name}: {e}")
 
-async def start_inactivity_timeout(game_id, user_id, first_name, question_idx, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Start a 5-minute inactivity timeout for a player on a specific question"""
-    global timeout_tasks
-    task_key = (game_id, user_id, question_idx)
-    
+async def _question_timeout_watch(game_id, question_idx, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Single 5-minute inactivity timer for a whole question round.
+
+    All players get the question at the same moment, so one sleeping
+    task per round replaces one per player. On expiry it checks who is
+    still awaiting this question; end_game_due_to_inactivity builds the
+    full laggard list itself.
+    """
     try:
         await asyncio.sleep(300)  # 5 minutes
-        # Only cancel the game if this timeout wasn't already cancelled
-        if task_key in timeout_tasks and timeout_tasks[task_key] is not None:
-            await end_game_due_to_inactivity(game_id, user_id, first_name, context)
     except asyncio.CancelledError:
-        # Task was cancelled, which is expected when player answers
-        pass
-    finally:
-        # Clean up the task reference
-        if task_key in timeout_tasks:
-            del timeout_tasks[task_key]
+        # Expected when the whole room answers in time
+        return
+    timeout_tasks.pop((game_id, question_idx), None)
+    pending = await asyncio.to_thread(
+        _db_fetchone,
+        'SELECT user_id, first_name FROM game_players WHERE game_id = ? AND awaiting_question_idx = ?',
+        (game_id, question_idx))
+    if pending:
+        await end_game_due_to_inactivity(game_id, pending[0], pending[1], context)
 
 async def cancel_question_timeouts(game_id, question_idx) -> None:
-    """Cancel all timeout tasks for a specific question"""
-    global timeout_tasks
-    
-    # Find and cancel all timeouts for this question
-    keys_to_remove = []
-    for key in list(timeout_tasks.keys()):
-        if key[0] == game_id and key[2] == question_idx:
-            task = timeout_tasks[key]
-            if task and not task.done():
-                task.cancel()
-            keys_to_remove.append(key)
-    
-    # Remove the keys
-    for key in keys_to_remove:
-        if key in timeout_tasks:
-            del timeout_tasks[key]
-
-async def cancel_player_timeout(game_id, user_id, question_idx) -> None:
-    """Cancel timeout task for a specific player on a specific question"""
-    global timeout_tasks
-    
-    task_key = (game_id, user_id, question_idx)
-    if task_key in timeout_tasks:
-        task = timeout_tasks[task_key]
-        if task and not task.done():
-            task.cancel()
-        del timeout_tasks[task_key]
+    """Cancel the shared timeout timer for a specific question"""
+    task = timeout_tasks.pop((game_id, question_idx), None)
+    if task and not task.done():
+        task.cancel()
 
 async def send_question_to_players(game_id, question_idx, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send current question to all players"""
@@ -1421,156 +1800,250 @@ async def send_question_to_players(game_id, question_idx, context: ContextTypes.
     
     question = QUESTIONS[question_idx]
     
-    # Prepare all player updates first
+    # One UPDATE covers the whole room instead of a statement per player
+    cursor.execute('''
+        UPDATE game_players SET awaiting_question_idx = ? WHERE game_id = ?
+    ''', (question_idx, game_id))
     updates = []
     for player_id, user_id, first_name in players:
-        cursor.execute('''
-            UPDATE game_players SET awaiting_question_idx = ? WHERE id = ?
-        ''', (question_idx, player_id))
+        awaiting_answer[user_id] = (game_id, question_idx, player_id)
         updates.append((user_id, first_name, player_id))
-    
+
     conn.commit()
     conn.close()
-    
-    # Now send messages AFTER closing database
-    conn = get_db_connection()
-    cursor = get_cursor(conn)
-    
-    for user_id, first_name, player_id in updates:
-        try:
-            msg = await context.bot.send_message(
-                chat_id=user_id,
-                text=f"❓ <b>Вопрос {question_idx + 1}/{len(QUESTIONS)}</b> (0/{total_players} ответили)\n\n<b>{question}</b>\n\n📝 Напиши свой ответ в чат:",
-                parse_mode='HTML'
-            )
-            # Delete old message records and store new message ID
-            cursor.execute('Delete FROM game_messages WHERE game_id = ? AND user_id = ?', (game_id, user_id))
-            cursor.execute('''
-                INSERT INTO game_messages (game_id, user_id, message_id)
-                VALUES (?, ?, ?)
-            ''', (game_id, user_id, msg.message_id))
-            conn.commit()
-            
-            # Start inactivity timeout for this player
-            task = asyncio.create_task(start_inactivity_timeout(game_id, user_id, first_name, question_idx, context))
-            timeout_tasks[(game_id, user_id, question_idx)] = task
-        except TelegramError as e:
-            logger.error(f"Failed to send message to {user_id}: {e}")
-    
-    conn.close()
 
-async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Handle player's answer - convert button click to text input"""
+    # The question text is identical for every player - build it once
+    question_text = f"❓ <b>Вопрос {question_idx + 1}/{len(QUESTIONS)}</b> (0/{total_players} ответили)\n\n<b>{question}</b>\n\n📝 Напиши свой ответ в чат:"
+
+    # Fan the sends out concurrently - each Telegram round-trip is
+    # independent, so the broadcast takes ~1 RTT instead of N
+    send_tasks = [
+        _tg_call(context.bot.send_message, chat_id=user_id, text=question_text, parse_mode='HTML')
+        for user_id, first_name, player_id in updates
+    ]
+    results = await asyncio.gather(*send_tasks, return_exceptions=True)
+
+    message_rows = []
+    for (user_id, first_name, player_id), msg in zip(updates, results):
+        if isinstance(msg, Exception):
+            logger.error(f"Failed to send message to {user_id}: {msg}")
+            continue
+        message_rows.append((game_id, user_id, msg.message_id))
+
+    # One shared inactivity timer covers the whole round
+    if updates:
+        timeout_tasks[(game_id, question_idx)] = asyncio.create_task(
+            _question_timeout_watch(game_id, question_idx, context))
+
+    # Store all the new question message ids in one upsert batch; the
+    # connection is only reacquired after the Telegram round trips
+    if message_rows:
+        conn = get_db_connection()
+        cursor = get_cursor(conn)
+        cursor.executemany(SQL_UPSERT_GAME_MESSAGE, message_rows)
+        conn.commit()
+        conn.close()
+
+async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                        game_id: int, question_idx: int, player_idx: int) -> int:
+    """Handle player's answer - convert button click to text input.
+
+    The callback data is already parsed by button_handler's compiled regex.
+    """
     query = update.callback_query
-    await query.answer()
-    
-    data = query.data.split('_')
-    game_id = int(data[1])
-    question_idx = int(data[2])
-    player_idx = int(data[3])
-    
+
     context.user_data['current_game_id'] = game_id
     context.user_data['current_question_idx'] = question_idx
     context.user_data['current_player_idx'] = player_idx
     
-    question = QUESTIONS[question_idx]
-    
     await query.edit_message_text(
-        text=f"❓ <b>Вопрос {question_idx + 1}/{len(QUESTIONS)}</b>\n\n<b>{question}</b>\n\n📝 <b>Напиши свой ответ в чат:</b>",
+        text=QUESTION_TEXTS[question_idx],
         parse_mode='HTML'
     )
     
     return WAITING_FOR_ANSWER
 
-async def receive_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Receive and save the answer"""
-    if not update.message or not update.message.text:
-        return WAITING_FOR_ANSWER
-    
-    user_id = update.effective_user.id
-    username = update.effective_user.username or f"User{user_id}"
-    log_user_activity(user_id, username)
-    answer = update.message.text
-    
-    conn = get_db_connection()
-    cursor = get_cursor(conn)
-    
-    cursor.execute('''
-        SELECT game_id, awaiting_question_idx, id FROM game_players 
-        WHERE user_id = ? AND awaiting_question_idx >= 0
-        LIMIT 1
-    ''', (user_id,))
-    
-    result = cursor.fetchone()
-    if not result:
-        conn.close()
-        return WAITING_FOR_ANSWER
-    
-    game_id, question_idx, player_idx = result
-    
-    # Delete existing answer if any (works for both PostgreSQL and SQLite)
-    cursor.execute('''
-        DELETE FROM game_answers WHERE game_id = ? AND question_idx = ? AND player_idx = ?
-    ''', (game_id, question_idx, player_idx))
-    
+def _save_answer(cursor, user_id, game_id, question_idx, player_idx, answer):
+    """Write one answer and return (total_players, answered_count).
+
+    Shared by receive_answer and handle_any_text so the two paths
+    cannot diverge. One upsert covers both the pre-created skeleton row
+    and games that were already running before those rows existed.
+    """
     cursor.execute('''
         INSERT INTO game_answers (game_id, question_idx, player_idx, answer)
         VALUES (?, ?, ?, ?)
+        ON CONFLICT (game_id, question_idx, player_idx)
+        DO UPDATE SET answer = excluded.answer, created_at = CURRENT_TIMESTAMP
     ''', (game_id, question_idx, player_idx, answer))
-    
+
     cursor.execute('''
         UPDATE game_players SET awaiting_question_idx = -1 WHERE id = ?
     ''', (player_idx,))
-    
+    awaiting_answer.pop(user_id, None)
+
+    # Prefer the in-memory tracker; fall back to one combined COUNT query
+    tracked = _track_answer(game_id, question_idx, player_idx)
+    if tracked:
+        return tracked
     cursor.execute('''
-        SELECT COUNT(*) FROM game_players WHERE game_id = ?
-    ''', (game_id,))
-    total_players = cursor.fetchone()[0]
-    
+        SELECT
+            (SELECT COUNT(*) FROM game_players WHERE game_id = ?),
+            (SELECT COUNT(*) FROM game_answers
+             WHERE game_id = ? AND question_idx = ? AND answer IS NOT NULL)
+    ''', (game_id, game_id, question_idx))
+    return cursor.fetchone()
+
+def _db_lookup_awaiting(user_id):
+    """Fallback lookup for players missing from the awaiting cache
+    (runs in a worker thread, e.g. right after a restart)."""
+    conn = get_db_connection()
+    cursor = get_cursor(conn)
     cursor.execute('''
-        SELECT COUNT(*) FROM game_answers 
-        WHERE game_id = ? AND question_idx = ? AND answer IS NOT NULL
-    ''', (game_id, question_idx))
-    answered_count = cursor.fetchone()[0]
-    
-    # Get all players to update their question messages with progress
+        SELECT game_id, awaiting_question_idx, id FROM game_players
+        WHERE user_id = ? AND awaiting_question_idx >= 0
+        LIMIT 1
+    ''', (user_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row
+
+def _db_lookup_player_status(user_id):
+    """Membership/status lookup for users who are not awaiting a question
+    (runs in a worker thread)."""
+    conn = get_db_connection()
+    cursor = get_cursor(conn)
     cursor.execute('''
-        SELECT user_id FROM game_players WHERE game_id = ?
-    ''', (game_id,))
-    all_player_ids = [row[0] for row in cursor.fetchall()]
-    
-    # Get the question text
+        SELECT game_id, awaiting_question_idx, is_admin FROM game_players
+        WHERE user_id = ?
+        LIMIT 1
+    ''', (user_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row
+
+def _db_save_answer_and_fetch(user_id, game_id, question_idx, player_idx, answer):
+    """Persist one answer and return (total, answered, player_messages)
+    in a single transaction (runs in a worker thread)."""
+    with _write_lock:
+        conn = get_db_connection()
+        cursor = get_cursor(conn)
+
+        total_players, answered_count = _save_answer(
+            cursor, user_id, game_id, question_idx, player_idx, answer)
+
+        # All players and their stored question messages for the progress edits
+        cursor.execute('''
+            SELECT gp.user_id, gm.message_id FROM game_players gp
+            LEFT JOIN game_messages gm ON gp.game_id = gm.game_id AND gp.user_id = gm.user_id
+            WHERE gp.game_id = ?
+        ''', (game_id,))
+        player_messages = cursor.fetchall()
+
+        conn.commit()
+        conn.close()
+    return total_players, answered_count, player_messages
+
+async def _broadcast_progress(player_messages, question_idx, answered_count,
+                              total_players, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Edit every player's question message with the new answer count.
+
+    The edits are independent Telegram round trips, so they run
+    concurrently under the send semaphore instead of serially.
+    """
     question = QUESTIONS[question_idx]
-    
+    progress_text = f"❓ <b>Вопрос {question_idx + 1}/{len(QUESTIONS)}</b> ({answered_count}/{total_players} ответили)\n\n<b>{question}</b>\n\n📝 Напиши свой ответ в чат:"
+
+    targets = [(uid, mid) for uid, mid in player_messages if mid]
+    results = await asyncio.gather(*(
+        _tg_call(context.bot.edit_message_text, chat_id=uid, message_id=mid,
+                 text=progress_text, parse_mode='HTML')
+        for uid, mid in targets
+    ), return_exceptions=True)
+    for (uid, _), result in zip(targets, results):
+        if isinstance(result, Exception):
+            logger.error(f"Failed to update progress for {uid}: {result}")
+
+# Debounce state for progress edits: latest counts and the pending timer
+# per (game_id, question_idx). A burst of answers inside the window
+# produces one broadcast with the newest count instead of one per answer
+_PROGRESS_DEBOUNCE = 0.8
+_progress_state = {}
+_progress_handles = {}
+
+def _fire_progress(key, context):
+    """Timer callback: broadcast the latest recorded progress for key"""
+    _progress_handles.pop(key, None)
+    state = _progress_state.pop(key, None)
+    if state is None:
+        return
+    player_messages, answered_count, total_players = state
+    context.application.create_task(_broadcast_progress(
+        player_messages, key[1], answered_count, total_players, context))
+
+def _schedule_progress(game_id, question_idx, player_messages, answered_count,
+                       total_players, context):
+    """Queue a debounced progress broadcast for this round.
+
+    Each answer only records the newest count; the actual edits go out at
+    most once per window, or immediately when the round is complete.
+    """
+    key = (game_id, question_idx)
+    _progress_state[key] = (player_messages, answered_count, total_players)
+    if answered_count >= total_players:
+        # Last answer: flush now so the full count isn't delayed behind
+        # the next question
+        handle = _progress_handles.pop(key, None)
+        if handle:
+            handle.cancel()
+        _fire_progress(key, context)
+        return
+    if key not in _progress_handles:
+        loop = asyncio.get_running_loop()
+        _progress_handles[key] = loop.call_later(
+            _PROGRESS_DEBOUNCE, _fire_progress, key, context)
+
+async def _advance_round(game_id, question_idx, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Cancel the finished round's timeouts and fan out the next question"""
+    await cancel_question_timeouts(game_id, question_idx)
+    await send_question_to_players(game_id, question_idx + 1, context)
+
+async def receive_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Receive and save the answer"""
+    if not update.message or not update.message.text:
+        return WAITING_FOR_ANSWER
+
+    user_id = update.effective_user.id
+    username = update.effective_user.username or f"User{user_id}"
+    answer = update.message.text
+    log_user_activity(user_id, username)
+
+    # Fast path from the in-memory registry; query only on a miss
+    result = awaiting_answer.get(user_id)
+    if result is None:
+        result = await asyncio.to_thread(_db_lookup_awaiting, user_id)
+    if not result:
+        return WAITING_FOR_ANSWER
+
+    game_id, question_idx, player_idx = result
+
+    # The whole write transaction runs off the event loop
+    total_players, answered_count, player_messages = await asyncio.to_thread(
+        _db_save_answer_and_fetch, user_id, game_id, question_idx, player_idx, answer)
+
     # Update question message for all players with new progress
-    for player_user_id in all_player_ids:
-        cursor.execute('''
-            SELECT message_id FROM game_messages WHERE game_id = ? AND user_id = ?
-        ''', (game_id, player_user_id))
-        msg_row = cursor.fetchone()
-        
-        if msg_row:
-            message_id = msg_row[0]
-            try:
-                await context.bot.edit_message_text(
-                    chat_id=player_user_id,
-                    message_id=message_id,
-                    text=f"❓ <b>Вопрос {question_idx + 1}/{len(QUESTIONS)}</b> ({answered_count}/{total_players} ответили)\n\n<b>{question}</b>\n\n📝 Напиши свой ответ в чат:",
-                    parse_mode='HTML'
-                )
-            except TelegramError as e:
-                logger.error(f"Failed to update progress for {player_user_id}: {e}")
-    
-    conn.commit()
-    
+    # (debounced - bursts of answers collapse into one edit per window)
+    _schedule_progress(game_id, question_idx, player_messages, answered_count,
+                       total_players, context)
+
     await update.message.reply_text("✅ Ответ сохранён!\n\nЖди других игроков...")
-    
-    if answered_count >= total_players:
-        # Cancel all timeouts for this question since all players answered
-        await cancel_question_timeouts(game_id, question_idx)
-        await send_question_to_players(game_id, question_idx + 1, context)
-    
-    conn.close()
+
+    if answered_count >= total_players and await _claim_question_advance(game_id, question_idx):
+        # Advance in the background: the next-question fanout (or story
+        # generation) is all Telegram I/O the final submitter shouldn't
+        # have to wait for
+        context.application.create_task(_advance_round(game_id, question_idx, context))
+
     return WAITING_FOR_ANSWER
 
 async def handle_any_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -1580,25 +2053,13 @@ async def handle_any_text(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     user_id = update.effective_user.id
     answer = update.message.text
-    
-    conn = get_db_connection()
-    cursor = get_cursor(conn)
-    
-    cursor.execute('''
-        SELECT game_id, awaiting_question_idx, id FROM game_players 
-        WHERE user_id = ? AND awaiting_question_idx >= 0
-        LIMIT 1
-    ''', (user_id,))
-    
-    result = cursor.fetchone()
+
+    # Fast path from the in-memory registry; query only on a miss
+    result = awaiting_answer.get(user_id)
+    if result is None:
+        result = await asyncio.to_thread(_db_lookup_awaiting, user_id)
     if not result:
-        cursor.execute('''
-            SELECT game_id, awaiting_question_idx, is_admin FROM game_players 
-            WHERE user_id = ?
-            LIMIT 1
-        ''', (user_id,))
-        user_result = cursor.fetchone()
-        
+        user_result = await asyncio.to_thread(_db_lookup_player_status, user_id)
         if user_result:
             game_id, awaiting_idx, is_admin = user_result
             if awaiting_idx < 0:
@@ -1609,9 +2070,7 @@ async def handle_any_text(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     message = "⏳ Ждём начала игры.\n\n" \
                               "Ожидаем, когда админ начнёт игру, или используй /reset."
                 await update.message.reply_text(message)
-            conn.close()
         else:
-            conn.close()
             # User not in any game
             await update.message.reply_text(
                 "❌ Вы не в игре.\n\n"
@@ -1619,72 +2078,29 @@ async def handle_any_text(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 "Если не можете найти свою комнату, используйте /reset для её сброса."
             )
         return
-    
+
     game_id, question_idx, player_idx = result
-    
-    # Cancel this player's timeout for the current question
-    await cancel_player_timeout(game_id, user_id, question_idx)
-    
-    # Save answer and update player status
-    # Delete existing answer if any (works for both PostgreSQL and SQLite)
-    cursor.execute('''
-        DELETE FROM game_answers WHERE game_id = ? AND question_idx = ? AND player_idx = ?
-    ''', (game_id, question_idx, player_idx))
-    
-    cursor.execute('''
-        INSERT INTO game_answers (game_id, question_idx, player_idx, answer)
-        VALUES (?, ?, ?, ?)
-    ''', (game_id, question_idx, player_idx, answer))
-    
-    cursor.execute('''
-        UPDATE game_players SET awaiting_question_idx = -1 WHERE id = ?
-    ''', (player_idx,))
-    
-    # Get counts and all player info BEFORE closing DB
-    cursor.execute('''
-        SELECT COUNT(*) FROM game_players WHERE game_id = ?
-    ''', (game_id,))
-    total_players = cursor.fetchone()[0]
-    
-    cursor.execute('''
-        SELECT COUNT(*) FROM game_answers 
-        WHERE game_id = ? AND question_idx = ? AND answer IS NOT NULL
-    ''', (game_id, question_idx))
-    answered_count = cursor.fetchone()[0]
-    
-    # Get all players and their message IDs
-    cursor.execute('''
-        SELECT gp.user_id, gm.message_id FROM game_players gp
-        LEFT JOIN game_messages gm ON gp.game_id = gm.game_id AND gp.user_id = gm.user_id
-        WHERE gp.game_id = ?
-    ''', (game_id,))
-    player_messages = cursor.fetchall()
-    
-    question = QUESTIONS[question_idx]
-    
-    conn.commit()
-    conn.close()
-    
+
+    # No per-player timer to cancel any more: the round's shared timer
+    # checks who is still pending when it fires
+
+    # The whole write transaction runs off the event loop
+    total_players, answered_count, player_messages = await asyncio.to_thread(
+        _db_save_answer_and_fetch, user_id, game_id, question_idx, player_idx, answer)
+
     # Send reply first
     await update.message.reply_text("✅ Ответ сохранён!\n\nЖди других игроков...")
-    
+
     # Now update question messages for all players AFTER closing DB
-    for player_user_id, message_id in player_messages:
-        if message_id:
-            try:
-                await context.bot.edit_message_text(
-                    chat_id=player_user_id,
-                    message_id=message_id,
-                    text=f"❓ <b>Вопрос {question_idx + 1}/{len(QUESTIONS)}</b> ({answered_count}/{total_players} ответили)\n\n<b>{question}</b>\n\n📝 Напиши свой ответ в чат:",
-                    parse_mode='HTML'
-                )
-            except TelegramError as e:
-                logger.error(f"Failed to update progress for {player_user_id}: {e}")
-    
-    if answered_count >= total_players:
-        # Cancel all timeouts for this question since all players answered
-        await cancel_question_timeouts(game_id, question_idx)
-        await send_question_to_players(game_id, question_idx + 1, context)
+    # (debounced - bursts of answers collapse into one edit per window)
+    _schedule_progress(game_id, question_idx, player_messages, answered_count,
+                       total_players, context)
+    
+    if answered_count >= total_players and await _claim_question_advance(game_id, question_idx):
+        # Advance in the background: the next-question fanout (or story
+        # generation) is all Telegram I/O the final submitter shouldn't
+        # have to wait for
+        context.application.create_task(_advance_round(game_id, question_idx, context))
 
 async def generate_stories(game_id, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Generate and send multiple rotated stories to all players"""
@@ -1703,10 +2119,10 @@ async def generate_stories(game_id, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info(f"[GENERATE_STORIES] Found {num_players} players: {players}")
     
     cursor.execute('''
-        SELECT question_idx, player_idx, answer FROM game_answers 
-        WHERE game_id = ? ORDER BY question_idx, player_idx
+        SELECT player_idx, question_idx, answer FROM game_answers
+        WHERE game_id = ? ORDER BY player_idx, question_idx
     ''', (game_id,))
-    
+
     all_answers = cursor.fetchall()
     logger.info(f"[GENERATE_STORIES] Found {len(all_answers)} answers")
     
@@ -1731,106 +2147,114 @@ async def generate_stories(game_id, context: ContextTypes.DEFAULT_TYPE) -> None:
     old_players = cursor.fetchall()
     
     cursor.execute('UPDATE games SET status = ? WHERE game_id = ?', ('completed', game_id))
-    
+    game_answer_state.pop(game_id, None)
+    GAME_LOCKS.pop(game_id, None)
+    _advanced_questions.pop(game_id, None)
+
+    # Pivot the sorted rows into one fixed-length answer list per player;
+    # each rotated story then indexes lists instead of probing a dict.
+    # The same stories list feeds both the history insert and the message
+    # sent to players below
+    answers_by_player = {}
+    for p_idx, group in groupby(all_answers, key=itemgetter(0)):
+        row_answers = list(_NO_ANSWERS)
+        for _, q_idx, player_answer in group:
+            if player_answer is not None:
+                row_answers[q_idx] = player_answer
+        answers_by_player[p_idx] = row_answers
+    stories = [
+        build_rotated_story(answers_by_player, story_num, num_players, player_ids)
+        for story_num in range(num_players)
+    ]
+
     # Save all stories to history BEFORE deleting game data
-    for story_num in range(num_players):
-        story_text = build_rotated_story(all_answers, story_num, num_players, player_ids)
-        cursor.execute('''
-            INSERT INTO story_history (room_code, story_text)
-            VALUES (?, ?)
-        ''', (room_code, story_text))
+    cursor.executemany('''
+        INSERT INTO story_history (room_code, story_text)
+        VALUES (?, ?)
+    ''', [(room_code, story_text) for story_text in stories])
     
     # Keep game data for statistics, only clean up message references
     cursor.execute('DELETE FROM game_messages WHERE game_id = ?', (game_id,))
     
     # Create new game
-    if USE_POSTGRES:
-        cursor.execute('''
-            INSERT INTO games (room_code, created_by, status, current_question_idx)
-            VALUES (%s, %s, %s, %s)
-            RETURNING game_id
-        ''', (room_code, created_by, 'waiting', 0))
-        new_game_id = cursor.fetchone()[0]
-    else:
-        cursor.execute('''
-            INSERT INTO games (room_code, created_by, status, current_question_idx)
-            VALUES (?, ?, ?, ?)
-        ''', (room_code, created_by, 'waiting', 0))
-        new_game_id = cursor.lastrowid
-    
+    cursor.execute('''
+        INSERT INTO games (room_code, created_by, status, current_question_idx)
+        VALUES (?, ?, ?, ?)
+        RETURNING game_id
+    ''', (room_code, created_by, 'waiting', 0))
+    new_game_id = cursor.fetchone()[0]
+
     # Add old players to new game
-    for user_id, username, first_name, is_admin in old_players:
-        cursor.execute('''
-            INSERT INTO game_players (game_id, user_id, username, first_name, is_admin)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (new_game_id, user_id, username, first_name, is_admin))
-    
+    cursor.executemany('''
+        INSERT INTO game_players (game_id, user_id, username, first_name, is_admin)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(new_game_id, user_id, username, first_name, is_admin)
+          for user_id, username, first_name, is_admin in old_players])
+
     conn.commit()
     conn.close()
-    
-    all_stories = "🎉 <b>ИСТОРИИ:</b>\n\n"
-    stories_list = []
-    
-    for story_num in range(num_players):
-        story_text = build_rotated_story(all_answers, story_num, num_players, player_ids)
-        # Format: first letter capital, rest lowercase
-        formatted_story = story_text[0].upper() + story_text[1:].lower() if story_text else ""
-        stories_list.append(formatted_story)
-        all_stories += f"{formatted_story}\n\n"
-    
+
+    waiting_rooms[room_code] = (new_game_id, created_by)
+
+    # One string build for the whole broadcast: header, the stories
+    # (first letter capital, rest lowercase) and the footer
+    stories_message = "".join((
+        "🎉 <b>ИСТОРИИ:</b>\n\n",
+        "".join(
+            f"{story_text[0].upper()}{story_text[1:].lower()}\n\n" if story_text else "\n\n"
+            for story_text in stories
+        ),
+        "\n\nДобавляйте друзей по коду и играйте снова!",
+    ))
     logger.info(f"[GENERATE_STORIES] Sending stories to {num_players} players")
-    for player_id, user_id, first_name in players:
-        try:
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=f"{all_stories}\n\nДобавляйте друзей по коду и играйте снова!",
-                parse_mode='HTML'
-            )
+    send_tasks = [
+        _tg_call(context.bot.send_message, chat_id=user_id, text=stories_message, parse_mode='HTML')
+        for player_id, user_id, first_name in players
+    ]
+    results = await asyncio.gather(*send_tasks, return_exceptions=True)
+    for (player_id, user_id, first_name), res in zip(players, results):
+        if isinstance(res, Exception):
+            logger.error(f"[GENERATE_STORIES] Failed to send stories to {user_id}: {res}")
+        else:
             logger.info(f"[GENERATE_STORIES] Stories sent to {first_name} (user_id={user_id})")
-        except TelegramError as e:
-            logger.error(f"[GENERATE_STORIES] Failed to send stories to {user_id}: {e}")
     
     # Show new room status
     logger.info(f"[GENERATE_STORIES] Calling update_room_players for new game_id={new_game_id}, room_code={room_code}")
     await update_room_players(new_game_id, room_code, context)
     logger.info(f"[GENERATE_STORIES] Completed for game_id={game_id}")
 
-def build_rotated_story(all_answers, story_num, num_players, player_ids):
-    """Build a story with rotated player order"""
-    story_answers = {}
-    for q_idx, p_idx, answer in all_answers:
-        story_answers[(q_idx, p_idx)] = answer
-    
-    words = []
-    for q_idx in range(len(QUESTIONS)):
-        player_idx_in_rotation = (story_num + q_idx) % num_players
-        actual_player_id = player_ids[player_idx_in_rotation]
-        
-        if (q_idx, actual_player_id) in story_answers:
-            words.append(story_answers[(q_idx, actual_player_id)])
-        else:
-            words.append("—")
-    
-    story = " ".join(words)
-    return story
+def build_rotated_story(answers_by_player, story_num, num_players, player_ids):
+    """Build a story with rotated player order.
+
+    answers_by_player maps player row id to a fixed-length answer list
+    (one slot per question), built once per game by generate_stories.
+    """
+    return " ".join(
+        answers_by_player.get(player_ids[(story_num + q_idx) % num_players], _NO_ANSWERS)[q_idx]
+        for q_idx in range(len(QUESTIONS))
+    )
 
 async def self_ping_task(app):
-    """Self-ping every 5 minutes to keep bot alive"""
-    while app.running:
-        try:
+    """Self-ping every 5 minutes to keep bot alive.
+
+    Same shape as activity_flush_task: app.running is still False while
+    post_init runs, so the loop must not gate on it.
+    """
+    try:
+        while True:
             await asyncio.sleep(300)  # 5 minutes
-            if app.running:
+            try:
                 await app.bot.get_me()
                 logger.info("[SELF_PING] Bot pinged successfully")
-        except asyncio.CancelledError:
-            logger.info("[SELF_PING] Ping task cancelled")
-            break
-        except Exception as e:
-            logger.error(f"[SELF_PING] Ping failed: {e}")
+            except Exception as e:
+                logger.error(f"[SELF_PING] Ping failed: {e}")
+    except asyncio.CancelledError:
+        logger.info("[SELF_PING] Ping task cancelled")
 
 async def post_init(app):
     """Called after bot initialization"""
     asyncio.create_task(self_ping_task(app))
+    asyncio.create_task(activity_flush_task(app))
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle errors"""
@@ -1847,7 +2271,9 @@ def main() -> None:
         print("ERROR: Please set TELEGRAM_BOT_TOKEN environment variable")
         return
     
-    app = Application.builder().token(token).post_init(post_init).build()
+    # concurrent_updates lets independent users' updates be processed in
+    # parallel tasks instead of serializing behind one slow handler
+    app = Application.builder().token(token).post_init(post_init).concurrent_updates(True).build()
 
     conv_handler = ConversationHandler(
         entry_points=[